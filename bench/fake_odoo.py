@@ -0,0 +1,374 @@
+"""In-memory stand-in for the parts of the Odoo XML-RPC and JSON-RPC API the updater uses.
+
+Records are kept in the format Odoo returns them from read (many2one as
+[id, name], many2many as a list of IDs). Every call is counted per model and
+method together with the request and response sizes.
+"""
+import collections
+import datetime
+import gzip
+import json
+import threading
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+# Field types of the models the updater touches. Fields that are not listed
+# are stored and returned as they are written.
+SCHEMA = {
+    "product.template": {
+        "product_variant_id": ("many2one", "product.product"),
+        "taxes_id": ("many2many", "account.tax"),
+        "supplier_taxes_id": ("many2many", "account.tax"),
+        "uom_id": ("many2one", "uom.uom"),
+        "uom_po_id": ("many2one", "uom.uom"),
+        "property_account_income_id": ("many2one", "account.account"),
+        "property_account_expense_id": ("many2one", "account.account"),
+        "margin_classification_id": ("many2one", "product.margin.classification"),
+        "print_category_id": ("many2one", "product.print.category"),
+        "public_categ_ids": ("many2many", "product.public.category"),
+        "standard_price": ("float", None),
+        "base_price_factor": ("float", None),
+        "qty_available": ("float", None),
+        "image": ("binary", None),
+    },
+    "product.product": {
+        "product_tmpl_id": ("many2one", "product.template"),
+    },
+    "product.supplierinfo": {
+        "name": ("many2one", "res.partner"),
+        "product_tmpl_id": ("many2one", "product.template"),
+        "price": ("float", None),
+    },
+    "stock.warehouse.orderpoint": {
+        "product_id": ("many2one", "product.product"),
+        "product_min_qty": ("float", None),
+        "product_max_qty": ("float", None),
+    },
+    "account.tax": {
+        "company_id": ("many2one", "res.company"),
+        "amount": ("float", None),
+    },
+    "account.account": {
+        "company_id": ("many2one", "res.company"),
+    },
+    "res.partner": {
+        "parent_id": ("many2one", "res.partner"),
+    },
+    "uom.uom": {
+        "category_id": ("many2one", "uom.category"),
+        "factor": ("float", None),
+        "factor_inv": ("float", None),
+        "rounding": ("float", None),
+    },
+}
+
+# Values of fields that are not set when a record is created
+DEFAULTS = {
+    "product.template": {"image": False, "write_date": False},
+}
+
+
+def now():
+    return datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = collections.Counter()
+            self.bytes_received = 0
+            self.bytes_sent = 0
+
+    def add_call(self, model, method):
+        with self._lock:
+            self.calls[(model, method)] += 1
+
+    def add_bytes(self, received, sent):
+        with self._lock:
+            self.bytes_received += received
+            self.bytes_sent += sent
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "rpc_calls": sum(self.calls.values()),
+                "rpc_calls_by_method": {
+                    "{}.{}".format(*key): n for key, n in sorted(self.calls.items())
+                },
+                "rpc_bytes_received": self.bytes_received,
+                "rpc_bytes_sent": self.bytes_sent,
+            }
+
+
+class FakeOdoo:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.records = collections.defaultdict(dict)
+        self._next_id = collections.defaultdict(lambda: 1)
+        self.stats = Stats()
+
+    # Storage
+
+    def _display_name(self, model, record_id):
+        record = self.records[model].get(record_id)
+        if record:
+            return record.get("name") or "{},{}".format(model, record_id)
+        return "{},{}".format(model, record_id)
+
+    def _convert(self, model, field, value):
+        field_type, target = SCHEMA.get(model, {}).get(field, (None, None))
+        if field_type == "many2one":
+            if isinstance(value, list):
+                return value
+            return [value, self._display_name(target, value)] if value else False
+        if field_type == "many2many":
+            ids = []
+            for command in value or []:
+                if isinstance(command, (list, tuple)):
+                    if command[0] == 6:
+                        ids = list(command[2])
+                    elif command[0] == 4:
+                        ids.append(command[1])
+                    elif command[0] == 5:
+                        ids = []
+                else:
+                    ids.append(command)
+            return ids
+        if field_type == "float" and value is not False:
+            return float(value)
+        return value
+
+    def insert(self, model, values):
+        with self._lock:
+            record_id = values.get("id") or self._next_id[model]
+            self._next_id[model] = max(self._next_id[model], record_id + 1)
+            record = dict(DEFAULTS.get(model, {}))
+            for field, value in values.items():
+                record[field] = self._convert(model, field, value)
+            record["id"] = record_id
+            record["write_date"] = now()
+            self.records[model][record_id] = record
+            return record_id
+
+    # Domains
+
+    def _field_value(self, model, record, path):
+        field, _, rest = path.partition(".")
+        value = record.get(field, False)
+        field_type, target = SCHEMA.get(model, {}).get(field, (None, None))
+        if not rest:
+            # Domains compare many2one fields by ID
+            if field_type == "many2one" and value:
+                return value[0]
+            return value
+        if not value or not target:
+            return False
+        related = self.records[target].get(value[0])
+        return self._field_value(target, related, rest) if related else False
+
+    @staticmethod
+    def _compare(value, operator, operand):
+        if isinstance(value, float) and isinstance(operand, str):
+            try:
+                operand = float(operand)
+            except ValueError:
+                pass
+        if operator == "=":
+            if isinstance(value, float) and isinstance(operand, (int, float)):
+                return abs(value - operand) <= 1e-9 * max(1, abs(operand))
+            if operand is False:
+                return not value
+            return value == operand
+        if operator == "!=":
+            return not FakeOdoo._compare(value, "=", operand)
+        if operator == "in":
+            if isinstance(value, list):
+                return bool(set(value) & set(operand))
+            return value in operand
+        if operator == "not in":
+            return not FakeOdoo._compare(value, "in", operand)
+        if value is False:
+            return False
+        if operator == ">":
+            return value > operand
+        if operator == ">=":
+            return value >= operand
+        if operator == "<":
+            return value < operand
+        if operator == "<=":
+            return value <= operand
+        if operator == "ilike":
+            return operand.lower() in (value or "").lower()
+        raise ValueError("Unsupported operator {}".format(operator))
+
+    def _match(self, model, record, domain):
+        def evaluate(items):
+            item = next(items)
+            if item == "|":
+                a, b = evaluate(items), evaluate(items)
+                return a or b
+            if item == "&":
+                a, b = evaluate(items), evaluate(items)
+                return a and b
+            if item == "!":
+                return not evaluate(items)
+            path, operator, operand = item
+            return self._compare(
+                self._field_value(model, record, path), operator, operand
+            )
+
+        items = iter(domain)
+        result = True
+        while True:
+            try:
+                result = evaluate(items) and result
+            except StopIteration:
+                return result
+
+    def _search(self, model, domain, offset=0, limit=None, order="id ASC"):
+        with self._lock:
+            records = [
+                r for r in self.records[model].values() if self._match(model, r, domain)
+            ]
+        records.sort(key=lambda r: r["id"], reverse="DESC" in (order or "").upper())
+        records = records[offset:]
+        if limit:
+            records = records[:limit]
+        return records
+
+    @staticmethod
+    def _fields(record, fields):
+        if not fields:
+            return dict(record)
+        return {f: record.get(f, False) for f in ["id"] + list(fields)}
+
+    # API
+
+    def authenticate(self, db, user, password, env):
+        self.stats.add_call("common", "authenticate")
+        return 2
+
+    def execute_kw(self, db, uid, password, model, method, args, kwargs=None):
+        self.stats.add_call(model, method)
+        kwargs = kwargs or {}
+        return getattr(self, "rpc_" + method)(model, *args, **kwargs)
+
+    def rpc_search(self, model, domain, offset=0, limit=None, order="id ASC"):
+        return [r["id"] for r in self._search(model, domain, offset, limit, order)]
+
+    def rpc_search_count(self, model, domain):
+        return len(self._search(model, domain))
+
+    def rpc_search_read(
+        self, model, domain, fields=None, offset=0, limit=None, order="id ASC"
+    ):
+        return [
+            self._fields(r, fields)
+            for r in self._search(model, domain, offset, limit, order)
+        ]
+
+    def rpc_read(self, model, ids, fields=None):
+        with self._lock:
+            return [
+                self._fields(self.records[model][i], fields)
+                for i in ids
+                if i in self.records[model]
+            ]
+
+    def rpc_write(self, model, ids, values):
+        with self._lock:
+            for i in ids:
+                record = self.records[model][i]
+                for field, value in values.items():
+                    record[field] = self._convert(model, field, value)
+                record["write_date"] = now()
+        return True
+
+    def rpc_create(self, model, values):
+        if isinstance(values, list):
+            return [self.insert(model, v) for v in values]
+        return self.insert(model, values)
+
+    def rpc_unlink(self, model, ids):
+        with self._lock:
+            for i in ids:
+                self.records[model].pop(i, None)
+        return True
+
+    def rpc_fields_get(self, model, attributes=None):
+        return {
+            field: {"type": field_type}
+            for field, (field_type, _) in SCHEMA.get(model, {}).items()
+        }
+
+
+class _RequestHandler(SimpleXMLRPCRequestHandler):
+    rpc_paths = ("/xmlrpc/2/common", "/xmlrpc/2/object")
+    # Odoo does not compress XML-RPC responses
+    encode_threshold = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if self.path != "/jsonrpc":
+            return super().do_POST()
+
+        data = self.rfile.read(int(self.headers["Content-Length"]))
+        received = len(data)
+        if self.headers.get("Content-Encoding") == "gzip":
+            data = gzip.decompress(data)
+        request = json.loads(data)
+        params = request["params"]
+        try:
+            method = getattr(self.server.odoo, params["method"])
+            response = {"result": method(*params["args"])}
+        except Exception as e:
+            response = {
+                "error": {
+                    "code": 200,
+                    "message": "Odoo Server Error",
+                    "data": {"name": type(e).__name__, "debug": repr(e)},
+                }
+            }
+        body = json.dumps({"jsonrpc": "2.0", "id": request.get("id"), **response})
+        body = body.encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.odoo.stats.add_bytes(received, len(body))
+
+
+class _Server(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+    def _marshaled_dispatch(self, data, dispatch_method=None, path=None):
+        response = super()._marshaled_dispatch(data, dispatch_method, path)
+        self.odoo.stats.add_bytes(len(data), len(response))
+        return response
+
+
+def serve(odoo, host="127.0.0.1", port=0):
+    """Serve odoo over XML-RPC in a background thread, return the server."""
+    server = _Server(
+        (host, port), requestHandler=_RequestHandler, logRequests=False, allow_none=True
+    )
+    server.odoo = odoo
+    server.register_function(odoo.authenticate, "authenticate")
+    server.register_function(odoo.execute_kw, "execute_kw")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def base_url(server):
+    return "http://{}:{}/".format(*server.server_address)
@@ -0,0 +1,183 @@
+"""Local stand-ins for the Terra FTP server and the supplier webshops serving images.
+
+Only the FTP commands ftplib uses to log in and download a file in passive
+mode are implemented.
+"""
+import hashlib
+import re
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+
+    def add(self, n_bytes):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += n_bytes
+
+
+class FtpFiles:
+    """Files served by the fake FTP server, with modification times for MDTM."""
+
+    def __init__(self):
+        self._files = {}
+        self._changes = 0
+        self.stats = Stats()
+
+    def put(self, name, content):
+        # MDTM only has a resolution of seconds, make sure every change is visible
+        self._changes += 1
+        self._files[name] = (content, time.gmtime(time.time() + self._changes))
+
+    def get(self, name):
+        return self._files.get(name)
+
+
+class _FtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode("ascii"))
+
+    def handle(self):
+        try:
+            self._handle()
+        except ConnectionError:
+            # ftplib closes connections without QUIT after aborted transfers
+            pass
+
+    def _handle(self):
+        files = self.server.files
+        passive = None
+        self.reply("220 Fake Terra FTP")
+        for raw in self.rfile:
+            command, _, argument = raw.decode("latin-1").strip().partition(" ")
+            command = command.upper()
+            if command == "USER":
+                self.reply("331 Password required")
+            elif command == "PASS":
+                self.reply("230 Logged in")
+            elif command == "TYPE":
+                self.reply("200 Type set")
+            elif command in ("MDTM", "SIZE"):
+                entry = files.get(argument)
+                if not entry:
+                    self.reply("550 No such file")
+                elif command == "MDTM":
+                    self.reply("213 " + time.strftime("%Y%m%d%H%M%S", entry[1]))
+                else:
+                    self.reply("213 {}".format(len(entry[0])))
+            elif command == "PASV":
+                passive = socket.socket()
+                passive.bind((self.server.server_address[0], 0))
+                passive.listen(1)
+                host, port = passive.getsockname()
+                self.reply(
+                    "227 Entering Passive Mode ({},{},{})".format(
+                        host.replace(".", ","), port >> 8, port & 0xFF
+                    )
+                )
+            elif command == "RETR":
+                entry = files.get(argument)
+                if not entry or not passive:
+                    self.reply("550 No such file")
+                    continue
+                self.reply("150 Opening data connection")
+                connection, _ = passive.accept()
+                try:
+                    connection.sendall(entry[0])
+                except OSError:
+                    # Client aborted the transfer
+                    pass
+                connection.close()
+                passive.close()
+                passive = None
+                files.stats.add(len(entry[0]))
+                self.reply("226 Transfer complete")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Not implemented")
+
+
+class _FtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve_ftp(files, host="127.0.0.1", port=0):
+    server = _FtpServer((host, port), _FtpHandler)
+    server.files = files
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class ImageHost:
+    """Serves a small fake JPEG for every image path whose key is in available."""
+
+    PATTERNS = [
+        re.compile(r"^/_artikelbilder_/(\d+)/\d+_medium\.jpg$"),
+        re.compile(r"^/images/vignettes/(\w+)_Z1\.jpg$"),
+    ]
+
+    def __init__(self, available=()):
+        self.available = set(available)
+        self.stats = Stats()
+
+    def image(self, path):
+        for pattern in self.PATTERNS:
+            match = pattern.match(path)
+            if match and match.group(1) in self.available:
+                return b"\xff\xd8\xff\xe0" + hashlib.sha256(path.encode()).digest() * 64
+        return None
+
+
+class _ImageHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        host = self.server.host
+        content = host.image(self.path)
+        if content is None:
+            body = b"Not found"
+            self.send_response(404)
+            self.send_header("Content-Type", "text/plain")
+        else:
+            etag = '"{}"'.format(hashlib.sha1(content).hexdigest())
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                host.stats.add(0)
+                return
+            body = content
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        host.stats.add(len(body))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_images(image_host, host="127.0.0.1", port=0):
+    server = ThreadingHTTPServer((host, port), _ImageHandler)
+    server.daemon_threads = True
+    server.host = image_host
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
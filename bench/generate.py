@@ -0,0 +1,240 @@
+"""Generators for synthetic Terra catalogs and a matching Odoo database."""
+import csv
+import os
+import random
+
+__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+
+TERRA_FILES = ["PL_FOOD.bnn", "PL_DROG.bnn", "PL_FRISCH.bnn"]
+
+PRODUCERS = ["SPI", "BOL", "GRN", "RAP", "XYZ"]
+PFAND_NUMBERS = ["998810", "998405", "998040", "123456"]
+BNN_COLUMNS = 69
+
+
+def ean(i):
+    return "40{:011d}".format(i)
+
+
+def format_decimal(value, places):
+    return "{:.{}f}".format(value, places).replace(".", ",")
+
+
+def terra_row(i, rng):
+    """Return the fields of one BNN-3 article, index 0 is field 1 of the spec."""
+    row = [""] * BNN_COLUMNS
+    row[0] = str(100000 + i)
+    row[1] = "X" if rng.random() < 0.01 else "A"
+    row[4] = ean(i)
+    row[6] = "Artikel {}".format(i)
+    row[7] = " bio"
+    row[8] = " {}g".format(rng.choice([250, 500, 1000]))
+    row[10] = rng.choice(PRODUCERS)
+    row[21] = "{} x 500g".format(rng.choice([1, 6, 12]))
+    row[22] = format_decimal(rng.choice([1, 6, 10, 12]), 3)
+    row[24] = format_decimal(rng.choice([1, 1, 1, 0.1]), 3)
+    row[26] = rng.choice(PFAND_NUMBERS) if rng.random() < 0.05 else ""
+    row[33] = rng.choice(["1", "2"])
+    row[37] = format_decimal(rng.uniform(0.3, 30), 2)
+    if rng.random() < 0.8:
+        row[65] = rng.choice(["kg", "lt"])
+        row[66] = format_decimal(rng.choice([1, 2, 4, 2.083]), 3)
+    else:
+        row[66] = format_decimal(0, 3)
+    return row
+
+
+def terra_catalog(n_articles, seed=0):
+    """Return the rows of the three Terra price lists with n_articles in total."""
+    rng = random.Random(seed)
+    rows = {name: [] for name in TERRA_FILES}
+    for i in range(n_articles):
+        rows[TERRA_FILES[i % len(TERRA_FILES)]].append(terra_row(i, rng))
+    return rows
+
+
+def change_prices(catalog, ratio, seed=1):
+    """Change the price of ratio of the articles in place, return their EANs."""
+    rng = random.Random(seed)
+    changed = set()
+    for rows in catalog.values():
+        for row in rows:
+            if rng.random() < ratio:
+                row[37] = format_decimal(rng.uniform(0.3, 30), 2)
+                changed.add(row[4])
+    return changed
+
+
+def bnn_file(rows):
+    header = "BNN;3;1;Terra Naturkost Handels KG;V;Preisliste;EUR;20240101;0;20240101;0600;1"
+    lines = [header] + [";".join(row) for row in rows] + [";;99"]
+    return ("\r\n".join(lines) + "\r\n").encode("cp850")
+
+
+def agidra_eans():
+    eans = []
+    for filename in ["agidra.csv", "agidra-2021-10-27.csv"]:
+        with open(os.path.join(__location__, "..", "data", filename)) as f:
+            eans += [row["Code EAN"] for row in csv.DictReader(f)]
+    return eans
+
+
+def populate_odoo(odoo, catalog, coverage=0.5, new_ratio=0.01, seed=0):
+    """Fill a FakeOdoo with reference data and products for coverage of the catalog.
+
+    Returns the barcodes of products without an image for which the fake webshop
+    should serve one.
+    """
+    rng = random.Random(seed)
+
+    odoo.insert("uom.category", {"id": 1, "name": "Unit"})
+    odoo.insert("uom.category", {"id": 2, "name": "Weight"})
+    for uom_id, name, category_id, rounding in [(1, "Units", 1, 1), (2, "kg", 2, 0.001)]:
+        odoo.insert(
+            "uom.uom",
+            {
+                "id": uom_id,
+                "name": name,
+                "category_id": category_id,
+                "factor": 1,
+                "factor_inv": 1,
+                "rounding": rounding,
+                "uom_type": "reference",
+            },
+        )
+    odoo.insert("res.company", {"id": 1, "name": "SuperCoop Berlin eG"})
+    for partner_id, name in [(11, "Terra Naturkost Handels KG"), (362, "AGIDRA")]:
+        odoo.insert(
+            "res.partner",
+            {"id": partner_id, "name": name, "is_company": True, "parent_id": False},
+        )
+        # A contact of the supplier with the same name
+        odoo.insert(
+            "res.partner",
+            {"name": name, "is_company": False, "parent_id": partner_id},
+        )
+    odoo.insert("product.public.category", {"name": "Glutenfrei"})
+    # Taxes and accounts like the ones references.py looks up
+    for tax_id, xml_name, type_tax_use, amount in [
+        (108, "tax_ust_19", "sale", 19),
+        (109, "tax_ust_7", "sale", 7),
+        (117, "tax_vst_19", "purchase", 19),
+        (118, "tax_vst_7", "purchase", 7),
+    ]:
+        odoo.insert(
+            "account.tax",
+            {
+                "id": tax_id,
+                "name": "Tax {}".format(tax_id),
+                "company_id": 1,
+                "type_tax_use": type_tax_use,
+                "amount_type": "percent",
+                "amount": amount,
+            },
+        )
+        odoo.insert(
+            "ir.model.data",
+            {
+                "module": "l10n_de_skr04",
+                "name": "1_{}_skr04".format(xml_name),
+                "model": "account.tax",
+                "res_id": tax_id,
+            },
+        )
+    for tax_id, amount in [(175, 0.15), (176, 0.08)]:
+        odoo.insert(
+            "account.tax",
+            {
+                "id": tax_id,
+                "name": "Pfand {:.2f}".format(amount),
+                "company_id": 1,
+                "type_tax_use": "sale",
+                "amount_type": "fixed",
+                "amount": amount,
+            },
+        )
+    for account_id, code in [(1864, "4300"), (1874, "4400"), (2025, "5300"), (2027, "5400")]:
+        odoo.insert(
+            "account.account",
+            {
+                "id": account_id,
+                "name": "Account {}".format(code),
+                "code": code,
+                "company_id": 1,
+            },
+        )
+
+    barcodes = [row[4] for rows in catalog.values() for row in rows]
+    barcodes = rng.sample(barcodes, int(len(barcodes) * coverage))
+    # Products of other suppliers and ones the updater does not know about
+    barcodes += agidra_eans()[:50]
+    barcodes += ["20{:011d}".format(i) for i in range(max(10, len(barcodes) // 20))]
+
+    images_available = set()
+    for barcode in barcodes:
+        new = rng.random() < new_ratio
+        has_image = not new and rng.random() < 0.98
+        product_id = odoo.insert(
+            "product.template",
+            {
+                "name": "NEW" if new else "Product {}".format(barcode),
+                "barcode": barcode,
+                "qty_available": rng.choice([0, 0, 3, 10]),
+                "image": "aW1hZ2U=" if has_image else False,
+                "uom_id": 1,
+                "uom_po_id": 1,
+                "taxes_id": [],
+                "supplier_taxes_id": [],
+                "standard_price": 0,
+                "property_account_income_id": False,
+                "property_account_expense_id": False,
+                "margin_classification_id": False,
+                "print_category_id": False,
+                "base_price_unit": False,
+                "base_price_factor": 0,
+                "available_in_pos": True,
+                "type": "product",
+                "product_importer_script_behavior": "enabled",
+            },
+        )
+        variant_id = odoo.insert(
+            "product.product", {"barcode": barcode, "product_tmpl_id": product_id}
+        )
+        odoo.records["product.template"][product_id]["product_variant_id"] = [
+            variant_id,
+            "Product {}".format(barcode),
+        ]
+        if rng.random() < 0.9:
+            odoo.insert(
+                "product.supplierinfo",
+                {
+                    "name": 11,
+                    "product_tmpl_id": product_id,
+                    "product_name": "",
+                    "product_code": "",
+                    "price": 0,
+                },
+            )
+        if rng.random() < 0.5:
+            odoo.insert(
+                "stock.warehouse.orderpoint",
+                {"product_id": variant_id, "product_min_qty": 2, "product_max_qty": 6},
+            )
+        if not has_image and rng.random() < 0.7:
+            images_available.add(barcode)
+
+    for i in range(20):
+        odoo.insert(
+            "ir.translation",
+            {"name": "product.template,name", "res_id": i + 1, "lang": "de_DE"},
+        )
+    return images_available
+
+
+def mark_new(odoo, n, seed=2):
+    """Turn n existing products into NEW products without image, return their IDs."""
+    rng = random.Random(seed)
+    ids = rng.sample(sorted(odoo.records["product.template"]), n)
+    for product_id in ids:
+        odoo.rpc_write("product.template", [product_id], {"name": "NEW", "image": False})
+    return ids
@@ -0,0 +1,182 @@
+"""End-to-end benchmark of update_from_terra_csv.py against local stand-ins.
+
+Starts a fake Odoo, a fake Terra FTP server and a fake image host, generates
+catalogs of the given sizes and runs the updater through a series of phases
+(cold and warm --all, --changed after a price update, filling NEW products).
+Wall time, RPC count, bytes transferred and peak RSS are reported per phase,
+together with the phase timings the script reports itself.
+
+    python bench/run.py --sizes 1000,10000,100000 --json bench_output.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import fake_odoo
+import fake_suppliers
+import generate
+
+__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+
+SCRIPT = os.path.join(__location__, "..", "update_from_terra_csv.py")
+
+
+class Bench:
+    def __init__(self, n_articles, protocol="xmlrpc"):
+        self.n_articles = n_articles
+        self.protocol = protocol
+        self.odoo = fake_odoo.FakeOdoo()
+        self.ftp_files = fake_suppliers.FtpFiles()
+        self.image_host = fake_suppliers.ImageHost()
+        self.cache_dir = tempfile.TemporaryDirectory(prefix="product-updater-bench-")
+
+        self.catalog = generate.terra_catalog(n_articles)
+        self.publish_catalog()
+        self.image_host.available = generate.populate_odoo(self.odoo, self.catalog)
+
+        self.odoo_server = fake_odoo.serve(self.odoo)
+        self.ftp_server = fake_suppliers.serve_ftp(self.ftp_files)
+        self.image_server = fake_suppliers.serve_images(self.image_host)
+
+    def publish_catalog(self):
+        for filename, rows in self.catalog.items():
+            self.ftp_files.put(filename, generate.bnn_file(rows))
+
+    def env(self):
+        image_url = "http://{}:{}/".format(*self.image_server.server_address)
+        return {
+            **os.environ,
+            "ODOO_BASE_URL": fake_odoo.base_url(self.odoo_server),
+            "ODOO_PROTOCOL": self.protocol,
+            "TERRA_FTP_HOST": self.ftp_server.server_address[0],
+            "TERRA_FTP_PORT": str(self.ftp_server.server_address[1]),
+            "TERRA_WEBSHOP_URL": image_url,
+            "AGIDRA_WEBSHOP_URL": image_url,
+            "PRODUCT_UPDATER_CACHE_DIR": self.cache_dir.name,
+        }
+
+    def run_phase(self, name, script_args):
+        for stats in [self.odoo.stats, self.ftp_files.stats, self.image_host.stats]:
+            stats.reset()
+
+        metrics_path = os.path.join(self.cache_dir.name, "metrics.json")
+        start = time.perf_counter()
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(
+                [sys.executable, SCRIPT, "--loglevel", "WARNING"]
+                + ["--metrics-json", metrics_path]
+                + script_args,
+                env=self.env(),
+                stdout=subprocess.DEVNULL,
+                stderr=stderr,
+            )
+            # Reap the child ourselves to get its resource usage
+            _, status, rusage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            wall_time = time.perf_counter() - start
+            stderr.seek(0)
+            stderr = stderr.read()
+
+        result = {
+            "articles": self.n_articles,
+            "phase": name,
+            "args": script_args,
+            "returncode": process.returncode,
+            "wall_time_s": round(wall_time, 3),
+            # ru_maxrss is in kilobytes on Linux
+            "peak_rss_kb": rusage.ru_maxrss,
+            **self.odoo.stats.as_dict(),
+            "ftp_downloads": self.ftp_files.stats.requests,
+            "ftp_bytes": self.ftp_files.stats.bytes_sent,
+            "http_requests": self.image_host.stats.requests,
+            "http_bytes": self.image_host.stats.bytes_sent,
+        }
+        if os.path.exists(metrics_path):
+            with open(metrics_path) as f:
+                result["script_phases"] = json.load(f)["phases"]
+            os.remove(metrics_path)
+        if process.returncode != 0:
+            result["stderr"] = stderr.decode(errors="replace")[-4000:]
+        return result
+
+    def run(self):
+        results = [
+            self.run_phase("cold --all", ["--all"]),
+            self.run_phase("warm --all", ["--all"]),
+        ]
+
+        generate.change_prices(self.catalog, ratio=0.02)
+        self.publish_catalog()
+        results.append(self.run_phase("--changed after 2% price change", ["--changed"]))
+
+        generate.mark_new(self.odoo, min(20, len(self.odoo.records["product.template"])))
+        results.append(self.run_phase("fill 20 NEW products", []))
+        return results
+
+    def close(self):
+        for server in [self.odoo_server, self.ftp_server, self.image_server]:
+            server.shutdown()
+            server.server_close()
+        self.cache_dir.cleanup()
+
+
+def print_table(results):
+    columns = [
+        ("articles", "{:>8}"),
+        ("phase", "{:<34}"),
+        ("wall_time_s", "{:>9}"),
+        ("rpc_calls", "{:>9}"),
+        ("rpc_bytes_sent", "{:>14}"),
+        ("ftp_bytes", "{:>11}"),
+        ("http_requests", "{:>13}"),
+        ("peak_rss_kb", "{:>11}"),
+    ]
+    print(" ".join(fmt.format(name[: len(fmt.format(""))]) for name, fmt in columns))
+    for result in results:
+        print(" ".join(fmt.format(str(result[name])) for name, fmt in columns))
+        phases = result.get("script_phases", {})
+        print(
+            " " * 9
+            + "  ".join("{} {:.3f}s".format(name, s) for name, s in phases.items())
+        )
+        if result["returncode"] != 0:
+            print(result["stderr"], file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes",
+        default="1000,10000,100000",
+        help="Comma-separated numbers of Terra articles to benchmark",
+    )
+    parser.add_argument(
+        "--protocol",
+        default="xmlrpc",
+        choices=["xmlrpc", "jsonrpc"],
+        help="Protocol the script talks to Odoo with",
+    )
+    parser.add_argument("--json", help="Also write the results to this file as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(",")]:
+        bench = Bench(size, args.protocol)
+        try:
+            results += bench.run()
+        finally:
+            bench.close()
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if all(r["returncode"] == 0 for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""Reader for article files in the BNN-3 format, see doc/BNN-3-Schnittstelle_01_04_2011.pdf.
+
+A file starts with a header record, followed by one record per article and an end
+record. Full price lists (Umfang V) contain every article, partial and special
+lists (T, S) only the changed ones, e.g. "Preisänderungen".
+"""
+import collections
+import csv
+import operator
+from decimal import Decimal
+
+# Umfang in the header
+FULL = "V"
+PARTIAL = "T"
+SPECIAL = "S"
+
+# Änderungskennung of a delisted article
+DELISTED = "X"
+
+# Numbers of the article fields in the spec, starting at 1
+FIELDS = {
+    "artikel_nr": 1,
+    "aenderungskennung": 2,
+    "aenderungsdatum": 3,
+    "aenderungszeit": 4,
+    "ean_laden": 5,
+    "ean_bestell": 6,
+    "bezeichnung": 7,
+    "bezeichnung2": 8,
+    "bezeichnung3": 9,
+    "handelsklasse": 10,
+    "hersteller": 11,
+    "hersteller_abweichend": 12,
+    "herkunft": 13,
+    "qualitaet": 14,
+    "kontrollstelle": 15,
+    "mhd_restlaufzeit": 16,
+    "wg_bnn": 17,
+    "wg_ifh": 18,
+    "wg_gh": 19,
+    "ersatz_artikel_nr": 20,
+    "min_bestell_menge": 21,
+    "bestelleinheit": 22,
+    "bestelleinheit_menge": 23,
+    "ladeneinheit": 24,
+    "mengenfaktor": 25,
+    "gewichtsartikel": 26,
+    "pfand_nr_ladeneinheit": 27,
+    "pfand_nr_bestelleinheit": 28,
+    "gewicht_ladeneinheit": 29,
+    "gewicht_bestelleinheit": 30,
+    "breite": 31,
+    "hoehe": 32,
+    "tiefe": 33,
+    "mwst_kennung": 34,
+    "vk_festpreis": 35,
+    "empf_vk": 36,
+    "empf_vk_gh": 37,
+    "preis": 38,
+    "rabattfaehig": 39,
+    "skontierfaehig": 40,
+    "artikelart": 61,
+    "aktionspreis": 62,
+    "aktionspreis_gueltig_ab": 63,
+    "aktionspreis_gueltig_bis": 64,
+    "empf_vk_aktion": 65,
+    "grundpreis_einheit": 66,
+    "grundpreis_faktor": 67,
+    "lieferbar_ab": 68,
+    "lieferbar_bis": 69,
+}
+for _i in range(1, 6):
+    FIELDS["staffel_menge{}".format(_i)] = 37 + 4 * _i
+    FIELDS["staffel_preis{}".format(_i)] = 38 + 4 * _i
+    FIELDS["rabattfaehig{}".format(_i)] = 39 + 4 * _i
+    FIELDS["skontierfaehig{}".format(_i)] = 40 + 4 * _i
+
+Header = collections.namedtuple(
+    "Header",
+    [
+        "charset",
+        "sender",
+        "scope",
+        "description",
+        "currency",
+        "valid_from",
+        "valid_until",
+        "created",
+        "file_counter",
+    ],
+)
+
+
+class BnnError(ValueError):
+    pass
+
+
+def _date(value, name, required=False):
+    # JJJJMMTT, 0 or empty for none
+    if value in ("", "0") and not required:
+        return None
+    if len(value) != 8 or not value.isdigit():
+        raise BnnError("Invalid {} {!r}".format(name, value))
+    return value
+
+
+def parse_header(fields, currencies=("EUR",)):
+    """Validate the fields of a header record and return them as a Header."""
+    if len(fields) < 12:
+        raise BnnError("Header has {} fields instead of 12".format(len(fields)))
+    if fields[0] != "BNN":
+        raise BnnError("Not a BNN file: {!r}".format(fields[0]))
+    if fields[1] != "3":
+        raise BnnError("Unsupported BNN version {!r}".format(fields[1]))
+    if fields[4] not in (FULL, PARTIAL, SPECIAL):
+        raise BnnError("Unknown Umfang {!r}".format(fields[4]))
+    if fields[6] not in currencies:
+        raise BnnError("Unexpected currency {!r}".format(fields[6]))
+    return Header(
+        charset=fields[2],
+        sender=fields[3],
+        scope=fields[4],
+        description=fields[5],
+        currency=fields[6],
+        valid_from=_date(fields[7], "DatumAb"),
+        valid_until=_date(fields[8], "DatumBis"),
+        created=_date(fields[9], "Abgabedatum", required=True),
+        file_counter=fields[11],
+    )
+
+
+def number(text):
+    """Convert a BNN number such as "1,500" to a Decimal."""
+    return Decimal(text.replace(",", "."))
+
+
+class BnnReader:
+    """Iterates over the article records of a BNN-3 file given as decoded lines.
+
+    Only the given fields are extracted, as a tuple per article in the same order,
+    by one compiled getter instead of indexing every field. Delisted articles are
+    skipped in full lists. Partial and special lists return them, so that callers
+    reading aenderungskennung can remove the articles. Raises BnnError for an
+    invalid header, an unexpected Umfang or a file without end record, e.g. a
+    truncated download.
+    """
+
+    def __init__(self, lines, fields, scopes=(FULL, PARTIAL, SPECIAL)):
+        self._rows = csv.reader(lines, delimiter=";")
+        try:
+            self.header = parse_header(next(self._rows))
+        except StopIteration:
+            raise BnnError("Empty file") from None
+        if self.header.scope not in scopes:
+            raise BnnError(
+                "Expected Umfang {}, got {} ({})".format(
+                    "/".join(scopes), self.header.scope, self.header.description
+                )
+            )
+        self.fields = list(fields)
+        indexes = [FIELDS[field] - 1 for field in self.fields]
+        self._change_index = FIELDS["aenderungskennung"] - 1
+        self._width = max(indexes + [self._change_index]) + 1
+        getter = operator.itemgetter(*indexes)
+        # itemgetter of a single index does not return a tuple
+        self._get = getter if len(indexes) > 1 else lambda row: (getter(row),)
+        self.next_file_counter = None
+
+    @property
+    def is_delta(self):
+        return self.header.scope != FULL
+
+    @property
+    def line_num(self):
+        """Number of the line the last article was read from."""
+        return self._rows.line_num
+
+    def __iter__(self):
+        get = self._get
+        width = self._width
+        change_index = self._change_index
+        skip_delisted = not self.is_delta
+        for row in self._rows:
+            if len(row) < width:
+                # End record: two empty fields and the counter of the next file, 99 at the end
+                if len(row) == 3 and not row[0] and not row[1]:
+                    self.next_file_counter = row[2]
+                    return
+                if not row:
+                    continue
+                # Trailing empty fields may be left out
+                row += [""] * (width - len(row))
+            if skip_delisted and row[change_index] == DELISTED:
+                continue
+            yield get(row)
+        raise BnnError("File ends without end record")
+
@@ -0,0 +1,283 @@
+"""Compact in-memory supplier catalogs.
+
+Records are stored column-wise instead of as one dict per article, decimal values
+as scaled integers that are only turned into Decimal when they are read. Catalogs
+behave like read-only dicts of records: `key in catalog`, `catalog[key]["field"]`.
+"""
+import array
+from decimal import Decimal
+
+
+class ConversionError(ValueError):
+    pass
+
+
+class TextColumn:
+    def __init__(self):
+        self._values = []
+
+    def extend(self, values):
+        self._values.extend(values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def truncate(self, size):
+        del self._values[size:]
+
+    def __getitem__(self, row):
+        return self._values[row]
+
+
+class SharedTextColumn(TextColumn):
+    """A text column for values that repeat a lot, e.g. producers or units."""
+
+    def __init__(self):
+        super().__init__()
+        self._shared = {}
+
+    def extend(self, values):
+        self._values.extend(map(self._shared.setdefault, values, values))
+
+    def __getstate__(self):
+        # The shared strings are restored by pickle anyway
+        return {"_values": self._values}
+
+    def __setstate__(self, state):
+        self._values = state["_values"]
+        self._shared = {value: value for value in self._values}
+
+
+class IntColumn:
+    """Integers, converted from the added values by convert if given."""
+
+    def __init__(self, convert=None):
+        self.convert = convert
+        self._values = array.array("q")
+
+    def extend(self, values):
+        self._values.extend(map(self.convert, values) if self.convert else values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def truncate(self, size):
+        del self._values[size:]
+
+    def __getitem__(self, row):
+        return self._values[row]
+
+
+class DecimalColumn:
+    """Decimal numbers given as text, stored as integers scaled by 10 ** places.
+
+    Values with a different number of decimal places are kept as Decimal so that
+    they read back exactly as given. Empty values are invalid unless optional is
+    set, then they read back as default.
+    """
+
+    def __init__(self, places, separator=",", optional=False, default=None):
+        self.places = places
+        self.separator = separator
+        self.optional = optional
+        self.default = default
+        self._values = array.array("q")
+        self._exact = {}
+
+    def extend(self, texts):
+        values = self._values
+        for text in texts:
+            if not text and self.optional:
+                self._exact[len(values)] = self.default
+                values.append(0)
+                continue
+            whole, _, fraction = text.partition(self.separator)
+            digits = whole + fraction
+            if len(fraction) == self.places and digits.lstrip("-").isdigit():
+                values.append(int(digits))
+            else:
+                self._exact[len(values)] = Decimal(text.replace(self.separator, "."))
+                values.append(0)
+
+    def __len__(self):
+        return len(self._values)
+
+    def truncate(self, size):
+        del self._values[size:]
+        for row in [row for row in self._exact if row >= size]:
+            del self._exact[row]
+
+    def __getitem__(self, row):
+        if row in self._exact:
+            return self._exact[row]
+        return Decimal(self._values[row]).scaleb(-self.places)
+
+
+class Record:
+    """Read-only view of one row of a Catalog."""
+
+    __slots__ = ("_columns", "_row")
+
+    def __init__(self, columns, row):
+        self._columns = columns
+        self._row = row
+
+    def __getitem__(self, field):
+        return self._columns[field][self._row]
+
+    def get(self, field, default=None):
+        column = self._columns.get(field)
+        return default if column is None else column[self._row]
+
+    def keys(self):
+        return self._columns.keys()
+
+    def __repr__(self):
+        return "Record({!r})".format({field: self[field] for field in self._columns})
+
+
+class Catalog:
+    """Records stored in columns, indexed by a key such as the EAN.
+
+    columns maps field names to column objects. add() takes the values of a record
+    in the order of columns; adding a key again replaces its record. Keys of a delta
+    catalog can be marked as removed so that ChainCatalog hides them. Added records
+    are converted into the columns in batches, which is a lot cheaper than one
+    value at a time, and can only be looked up once their batch is converted: call
+    finish() after the last add(). A value that cannot be converted raises
+    ConversionError, and nothing of its batch is added.
+    """
+
+    BATCH_SIZE = 4096
+
+    def __init__(self, columns):
+        self._columns = columns
+        self._rows = {}
+        self._size = 0
+        self._pending = []
+        # (key, line number in the source file or None) of the pending records
+        self._pending_keys = []
+        self.removed = set()
+
+    def add(self, key, values, line=None):
+        self._pending.append(values)
+        self._pending_keys.append((key, line))
+        if len(self._pending) >= self.BATCH_SIZE:
+            self._convert_pending()
+
+    def remove(self, key):
+        # Keep the order of adding and removing the same key
+        self.finish()
+        self._rows.pop(key, None)
+        self.removed.add(key)
+
+    def finish(self):
+        """Convert the records added since the last batch."""
+        if self._pending:
+            self._convert_pending()
+
+    def _convert_pending(self):
+        pending, self._pending = self._pending, []
+        keys, self._pending_keys = self._pending_keys, []
+        columns = list(self._columns.items())
+        try:
+            for i, ((field, column), values) in enumerate(zip(columns, zip(*pending))):
+                column.extend(values)
+        except (ValueError, ArithmeticError) as e:
+            # Columns are extended up to the value that failed
+            failed = len(column) - self._size
+            key, line = keys[failed]
+            for _, other in columns:
+                other.truncate(self._size)
+            raise ConversionError(
+                "{}Invalid {} {!r} of {}".format(
+                    "Line {}: ".format(line) if line else "",
+                    field,
+                    pending[failed][i],
+                    key,
+                )
+            ) from e
+        for key, _ in keys:
+            self._rows[key] = self._size
+            self._size += 1
+            self.removed.discard(key)
+
+    def _record(self, row):
+        return Record(self._columns, row)
+
+    def __getstate__(self):
+        self.finish()
+        return self.__dict__
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def __getitem__(self, key):
+        return self._record(self._rows[key])
+
+    def get(self, key, default=None):
+        row = self._rows.get(key)
+        return default if row is None else self._record(row)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def keys(self):
+        return self._rows.keys()
+
+    def items(self):
+        for key, row in self._rows.items():
+            yield key, self._record(row)
+
+
+class ChainCatalog:
+    """Several catalogs looked up as one without copying them.
+
+    Like merging dicts, a key in a later catalog shadows the same key in earlier ones.
+    Keys removed from a later catalog are hidden, so a delta catalog can be chained
+    after the full one.
+    """
+
+    def __init__(self, catalogs):
+        self._catalogs = list(reversed(catalogs))
+
+    def _find(self, key):
+        for catalog in self._catalogs:
+            if key in catalog:
+                return catalog
+            if key in catalog.removed:
+                return None
+        return None
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __getitem__(self, key):
+        catalog = self._find(key)
+        if catalog is None:
+            raise KeyError(key)
+        return catalog[key]
+
+    def get(self, key, default=None):
+        catalog = self._find(key)
+        return default if catalog is None else catalog[key]
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __iter__(self):
+        for i, catalog in enumerate(self._catalogs):
+            newer = self._catalogs[:i]
+            for key in catalog:
+                if not any(key in other or key in other.removed for other in newer):
+                    yield key
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for key in self:
+            yield key, self[key]
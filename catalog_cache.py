@@ -0,0 +1,249 @@
+import codecs
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import pickle
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ftplib import error_perm, error_reply, error_temp
+
+import resilience
+
+__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+
+CACHE_DIR = os.environ.get(
+    "PRODUCT_UPDATER_CACHE_DIR", os.path.join(__location__, "cache")
+)
+
+# Bump whenever the layout of the parsed records changes so that old snapshots
+# are not loaded into newer code.
+SNAPSHOT_VERSION = 6
+
+logger = logging.getLogger(__name__)
+
+# Catalogs parsed by this process by filename, with the stamp they were parsed at.
+# Long-running processes use it to skip reading the snapshot again.
+_loaded = {}
+
+
+def cache_path(filename):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return os.path.join(CACHE_DIR, filename)
+
+
+def read_snapshot(filename):
+    try:
+        with open(cache_path(filename), "rb") as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.warning("Ignoring unreadable cache file %s", filename, exc_info=True)
+        return None
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+
+def write_snapshot(filename, snapshot):
+    path = cache_path(filename)
+    # Write to a temporary file first so that a crash never leaves a half-written snapshot
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(
+            {**snapshot, "version": SNAPSHOT_VERSION}, f, pickle.HIGHEST_PROTOCOL
+        )
+    os.replace(tmp_path, path)
+
+
+def read_state(filename, default=None):
+    """Read small JSON state that is kept between runs."""
+    try:
+        with open(cache_path(filename)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except ValueError:
+        logger.warning("Ignoring unreadable state file %s", filename)
+        return default
+
+
+def write_state(filename, state):
+    path = cache_path(filename)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def remove_state(filename):
+    try:
+        os.remove(cache_path(filename))
+    except FileNotFoundError:
+        pass
+
+
+@contextlib.contextmanager
+def run_lock(filename="update.lock", wait=False):
+    """Hold an exclusive lock on a file in the cache directory while the block runs.
+
+    Yields whether the lock was acquired. Without wait, it is not acquired if another
+    process holds it. The lock is released by the OS if the process dies.
+    """
+    with open(cache_path(filename), "w") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def get_remote_file_stamp(ftp, filename):
+    """Return (modification time, size) of a file on the FTP server.
+
+    Returns None if the server does not support MDTM/SIZE.
+    """
+    try:
+        # SIZE is only well-defined in binary mode
+        ftp.voidcmd("TYPE I")
+        mdtm = ftp.voidcmd("MDTM {}".format(filename)).split()[-1]
+        size = ftp.size(filename)
+    except (error_perm, error_reply):
+        logger.debug("Server does not report MDTM/SIZE for %s", filename)
+        return None
+    return mdtm, size
+
+
+class _TransferAborted(Exception):
+    pass
+
+
+_END_OF_TRANSFER = object()
+
+
+def iter_ftp_lines(ftp, filename, encoding="cp850", max_pending_chunks=64):
+    """Yield the decoded lines of a file while it is still being downloaded.
+
+    The transfer runs in a background thread. At most max_pending_chunks received
+    chunks are buffered, so a slow consumer throttles the download instead of the
+    whole file piling up in memory.
+    """
+    chunks = queue.Queue(max_pending_chunks)
+    stop = threading.Event()
+
+    def on_chunk(chunk):
+        if stop.is_set():
+            raise _TransferAborted()
+        chunks.put(chunk)
+
+    def download():
+        try:
+            ftp.retrbinary("RETR {}".format(filename), on_chunk)
+        except _TransferAborted:
+            return
+        except Exception as e:
+            chunks.put(e)
+            return
+        chunks.put(_END_OF_TRANSFER)
+
+    download_thread = threading.Thread(target=download, daemon=True)
+    download_thread.start()
+
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ""
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is _END_OF_TRANSFER:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            pending += decoder.decode(chunk)
+            # Only hand out complete lines, the rest waits for the next chunk
+            end = pending.rfind("\n")
+            if end >= 0:
+                for line in pending[:end].split("\n"):
+                    yield line + "\n"
+                pending = pending[end + 1 :]
+        pending += decoder.decode(b"", final=True)
+        if pending:
+            yield pending
+    finally:
+        # The consumer may stop early, make sure the download thread does not block forever
+        stop.set()
+        while download_thread.is_alive():
+            try:
+                chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def load_ftp_catalog(ftp, filename, parse, encoding="cp850"):
+    """Download and parse a catalog file, reusing the parsed result if the file is unchanged.
+
+    parse is called with an iterable of decoded lines and must return a picklable object.
+    """
+    snapshot_name = "{}.pickle".format(filename)
+    stamp = get_remote_file_stamp(ftp, filename)
+    if stamp and filename in _loaded and _loaded[filename][0] == stamp:
+        return _loaded[filename][1]
+
+    snapshot = read_snapshot(snapshot_name)
+    if stamp and snapshot and snapshot["stamp"] == stamp:
+        logger.debug("%s unchanged since %s, using cached catalog", filename, stamp[0])
+        _loaded[filename] = (stamp, snapshot["products"])
+        return snapshot["products"]
+
+    logger.info("Downloading %s", filename)
+    lines = iter_ftp_lines(ftp, filename, encoding)
+    try:
+        products = parse(lines)
+    finally:
+        lines.close()
+
+    if stamp:
+        write_snapshot(snapshot_name, {"stamp": stamp, "products": products})
+        _loaded[filename] = (stamp, products)
+    return products
+
+
+def forget_loaded():
+    """Make the next load_ftp_catalog read catalogs from the snapshot or FTP again."""
+    _loaded.clear()
+
+
+def load_ftp_catalogs(connect, catalogs, encoding="cp850"):
+    """Load several catalogs concurrently, each over its own FTP connection.
+
+    catalogs is a list of (filename, parse) tuples, connect a function returning a
+    logged-in FTP connection. Returns the parsed catalogs in the same order. A catalog
+    whose download fails with a temporary or network error is loaded again over a
+    new connection.
+    """
+
+    def load(filename, parse):
+        ftp = connect()
+        try:
+            return load_ftp_catalog(ftp, filename, parse, encoding)
+        finally:
+            ftp.close()
+
+    def load_with_retry(filename, parse):
+        return resilience.retry(
+            lambda: load(filename, parse),
+            "Loading {}".format(filename),
+            lambda e: isinstance(e, (error_temp, OSError, EOFError)),
+        )
+
+    with ThreadPoolExecutor(max_workers=len(catalogs)) as executor:
+        futures = [
+            executor.submit(load_with_retry, filename, parse)
+            for filename, parse in catalogs
+        ]
+        return [f.result() for f in futures]
@@ -0,0 +1,37 @@
+import hashlib
+
+import catalog_cache
+
+
+def record_digest(record, fields):
+    values = repr(tuple(record[field] for field in fields))
+    return hashlib.blake2b(values.encode("utf-8"), digest_size=8).digest()
+
+
+class CatalogDiff:
+    """Compares a supplier catalog to the one last applied to Odoo.
+
+    Only a digest of the given fields per key is kept, so unrelated changes (e.g.
+    to a description we do not use) do not mark a record as changed.
+    """
+
+    def __init__(self, name, catalog, fields):
+        self._snapshot_name = "{}-applied.pickle".format(name)
+        self._digests = {key: record_digest(r, fields) for key, r in catalog.items()}
+
+    def changed_keys(self):
+        """Return the keys that are new or changed since save() was last called.
+
+        If there is no previous snapshot all keys are returned.
+        """
+        snapshot = catalog_cache.read_snapshot(self._snapshot_name)
+        if not snapshot:
+            return set(self._digests)
+        applied = snapshot["digests"]
+        return {
+            key for key, digest in self._digests.items() if applied.get(key) != digest
+        }
+
+    def save(self):
+        """Remember the current catalog as applied."""
+        catalog_cache.write_snapshot(self._snapshot_name, {"digests": self._digests})
@@ -0,0 +1,197 @@
+"""Changesets: the writes and creates of an update, recorded instead of sent to Odoo.
+
+A changeset is saved as JSONL, one line per call grouped by model and operation:
+
+    {"model": "product.template", "op": "write", "ids": [1, 2], "values": {...}}
+    {"model": "product.supplierinfo", "op": "create", "values": {...}}
+
+Records the update itself would have to create first, units of measure, get a
+negative placeholder ID in "ref" that later lines use until the changeset is applied.
+"""
+import collections
+import datetime
+import json
+import logging
+import os
+
+import odoo_utils
+
+logger = logging.getLogger(__name__)
+
+# Models whose records are created before everything else because other lines refer to them
+REFERENCED_MODELS = ["uom.uom"]
+
+# Creates are skipped if a record with the same values of these fields exists, e.g.
+# because a regular run created it after the plan was saved
+UNIQUE_FIELDS = {
+    "product.supplierinfo": ["product_tmpl_id", "name"],
+    "stock.warehouse.orderpoint": ["product_id"],
+}
+
+
+class AlreadyApplied(Exception):
+    pass
+
+
+class Changeset:
+    """Collects writes and creates like odoo_utils.BatchWriter, without sending them."""
+
+    def __init__(self):
+        # (entity, serialized fields) -> (fields, ids), in the order of the first write
+        self._writes = dict()
+        self._creates = collections.defaultdict(list)
+        self._next_ref = -1
+        # Never filled, nothing is written to Odoo
+        self.written_ids = collections.defaultdict(set)
+
+    def write(self, entity, ids, fields):
+        key = (entity, json.dumps(fields, sort_keys=True, default=str))
+        self._writes.setdefault(key, (fields, []))[1].extend(ids)
+
+    def create(self, entity, fields):
+        self._creates[entity].append((None, fields))
+
+    def create_referenced(self, entity, values):
+        """Record creates of records that later lines refer to, return their placeholder IDs."""
+        refs = []
+        for fields in values:
+            refs.append(self._next_ref)
+            self._creates[entity].append((self._next_ref, fields))
+            self._next_ref -= 1
+        return refs
+
+    def flush_writes(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def lines(self):
+        entities = REFERENCED_MODELS + sorted(
+            set(self._creates) - set(REFERENCED_MODELS)
+        )
+        for entity in entities:
+            for ref, fields in self._creates.get(entity, []):
+                line = {"model": entity, "op": "create", "values": fields}
+                if ref is not None:
+                    line["ref"] = ref
+                yield line
+        for (entity, _), (fields, ids) in sorted(
+            self._writes.items(), key=lambda item: item[0][0]
+        ):
+            yield {"model": entity, "op": "write", "ids": ids, "values": fields}
+
+    def save(self, path):
+        n = 0
+        with open(path, "w") as f:
+            for line in self.lines():
+                f.write(json.dumps(line, default=str) + "\n")
+                n += 1
+        logger.info("Wrote %d changes to %s", n, path)
+
+
+def _resolve(fields, created):
+    # Placeholders only occur as many2one values
+    return {
+        name: created.get(value, value) if isinstance(value, int) else value
+        for name, value in fields.items()
+    }
+
+
+def _applied_marker(path):
+    return path + ".applied"
+
+
+def is_applied(path):
+    return os.path.exists(_applied_marker(path))
+
+
+def _existing_keys(c, entity, fields, values):
+    """Return the values of fields of the records of entity that the creates would duplicate."""
+    first = fields[0]
+    ids = sorted({v[first] for v in values if isinstance(v.get(first), int)})
+    if not ids:
+        return set()
+    return {
+        # many2one values are [id, display_name]
+        tuple(r[field][0] if r[field] else False for field in fields)
+        for r in c.search_read_iter(entity, [[first, "in", ids]], fields=fields)
+    }
+
+
+def apply(path, c, writer):
+    """Send a saved changeset to Odoo through writer, a BatchWriter.
+
+    Records that exist by now, e.g. because a regular run created them after the
+    changeset was saved, are not created again, so applying a changeset again after
+    a failure is safe. Once applied, it is marked as such and cannot be applied again.
+    """
+    if is_applied(path):
+        raise AlreadyApplied("{} was already applied".format(path))
+    with open(path) as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+
+    # Create the referenced records first, one call per model, to know their IDs
+    created = {}
+    referenced = collections.defaultdict(list)
+    for line in lines:
+        if "ref" in line:
+            referenced[line["model"]].append(line)
+    uoms = odoo_utils.UomRegistry(c)
+    n = n_skipped = 0
+    for entity, entity_lines in referenced.items():
+        missing = []
+        for line in entity_lines:
+            values = line["values"]
+            existing_id = None
+            if entity == "uom.uom":
+                existing_id = uoms.find(
+                    values["factor"], values["rounding"], values["category_id"]
+                )
+            if existing_id:
+                created[line["ref"]] = existing_id
+                n_skipped += 1
+            else:
+                missing.append(line)
+        if missing:
+            logger.info("Creating %d %s records", len(missing), entity)
+            ids = c.create(entity, [line["values"] for line in missing])
+            created.update(zip((line["ref"] for line in missing), ids))
+            n += len(missing)
+
+    creates = collections.defaultdict(list)
+    for line in lines:
+        if "ref" not in line and line["op"] == "create":
+            creates[line["model"]].append(_resolve(line["values"], created))
+    existing = {
+        entity: _existing_keys(c, entity, UNIQUE_FIELDS[entity], values)
+        for entity, values in creates.items()
+        if entity in UNIQUE_FIELDS
+    }
+
+    for line in lines:
+        if "ref" in line:
+            continue
+        fields = _resolve(line["values"], created)
+        if line["op"] == "create":
+            if line["model"] in existing:
+                key = tuple(fields[field] for field in UNIQUE_FIELDS[line["model"]])
+                if key in existing[line["model"]]:
+                    n_skipped += 1
+                    continue
+                existing[line["model"]].add(key)
+            writer.create(line["model"], fields)
+        elif line["op"] == "write":
+            writer.write(line["model"], line["ids"], fields)
+        else:
+            raise ValueError("Unknown operation {!r} in {}".format(line["op"], path))
+        n += 1
+    writer.flush()
+    with open(_applied_marker(path), "w") as f:
+        f.write(datetime.datetime.now().isoformat() + "\n")
+    logger.info(
+        "Applied %d changes from %s, skipped %d creates of existing records",
+        n,
+        path,
+        n_skipped,
+    )
@@ -0,0 +1,169 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import catalog_cache
+import resilience
+
+logger = logging.getLogger(__name__)
+
+
+def _is_transient_error(e):
+    if isinstance(e, requests.HTTPError):
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+
+class ImageFetcher:
+    """Downloads product images concurrently and caches them on disk by URL.
+
+    Cached images are revalidated with ETag/Last-Modified. Missing images (404,
+    non-image responses) are remembered for negative_ttl seconds so that they are
+    not requested on every run. Network errors and overloaded servers are retried;
+    a host that keeps failing is not asked again for a while, see
+    resilience.CircuitBreaker. Images that could not be downloaded because of that
+    are tried again by the next run, cached ones are used meanwhile.
+    """
+
+    def __init__(self, workers=8, timeout=10, negative_ttl=24 * 60 * 60):
+        self.workers = workers
+        self.timeout = timeout
+        self.negative_ttl = negative_ttl
+        self._breakers = {}
+        self._breakers_lock = threading.Lock()
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+        self._dir = catalog_cache.cache_path("images")
+        os.makedirs(self._dir, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self._dir, key + ".json"), os.path.join(self._dir, key)
+
+    def _read_meta(self, meta_path):
+        try:
+            with open(meta_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, meta_path, meta, content_path=None, content=None):
+        if content is not None:
+            with open(content_path + ".tmp", "wb") as f:
+                f.write(content)
+            os.replace(content_path + ".tmp", content_path)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def fetch(self, url):
+        """Return the image at url base64-encoded, or None if there is none."""
+        meta_path, content_path = self._paths(url)
+        meta = self._read_meta(meta_path)
+
+        if meta and not meta["found"]:
+            if time.time() - meta["checked"] < self.negative_ttl:
+                return None
+            meta = None
+
+        headers = {}
+        if meta and os.path.exists(content_path):
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        else:
+            meta = None
+
+        try:
+            response = resilience.retry(
+                lambda: self._get(url, headers),
+                "Downloading image {}".format(url),
+                _is_transient_error,
+                attempts=3,
+                base_delay=0.5,
+            )
+        except resilience.CircuitOpenError:
+            response = None
+        except requests.RequestException as e:
+            logger.warning("Could not download image %s: %s", url, e)
+            if not _is_transient_error(e):
+                self._write(meta_path, {"found": False, "checked": time.time()})
+                return None
+            response = None
+
+        if response is None:
+            # Tried again by the next run, until then a cached image is better than none
+            if not meta:
+                return None
+            with open(content_path, "rb") as f:
+                content = f.read()
+        elif meta and response.status_code == 304:
+            with open(content_path, "rb") as f:
+                content = f.read()
+        elif response.status_code == 200 and response.headers.get(
+            "Content-Type", ""
+        ).startswith("image/"):
+            content = response.content
+            self._write(
+                meta_path,
+                {
+                    "found": True,
+                    "checked": time.time(),
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                },
+                content_path,
+                content,
+            )
+        else:
+            logger.debug("No image at %s (HTTP %d)", url, response.status_code)
+            self._write(meta_path, {"found": False, "checked": time.time()})
+            return None
+
+        return base64.b64encode(content).decode("ascii")
+
+    def _breaker(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self._breakers_lock:
+            if host not in self._breakers:
+                self._breakers[host] = resilience.CircuitBreaker("Image host " + host)
+            return self._breakers[host]
+
+    def _get(self, url, headers):
+        breaker = self._breaker(url)
+        if not breaker.allow():
+            raise resilience.CircuitOpenError(breaker.name)
+        try:
+            response = self._session.get(url, headers=headers, timeout=self.timeout)
+            if response.status_code == 429 or response.status_code >= 500:
+                raise requests.HTTPError(
+                    "HTTP {}".format(response.status_code), response=response
+                )
+        except requests.RequestException as e:
+            if _is_transient_error(e):
+                breaker.failed()
+            raise
+        breaker.succeeded()
+        return response
+
+    def fetch_all(self, urls):
+        """Fetch all urls concurrently, return a dict of url to base64 image or None."""
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return dict(zip(urls, executor.map(self.fetch, urls)))
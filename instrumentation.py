@@ -0,0 +1,147 @@
+import bisect
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+# Upper bounds in seconds of the RPC latency histogram buckets
+LATENCY_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float("inf")]
+
+
+class RpcStats:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 3),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "latency_histogram": {
+                str(bound): count for bound, count in zip(LATENCY_BUCKETS, self.buckets)
+            },
+        }
+
+
+class Metrics:
+    """Collects RPC statistics and phase timings of one run."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Start collecting for a new run, e.g. the next iteration of the daemon."""
+        with self._lock:
+            self.started = time.time()
+            self.rpc = collections.defaultdict(RpcStats)
+            self.phases = collections.OrderedDict()
+            self.counters = collections.Counter()
+
+    def record_rpc(self, model, method, seconds, bytes_sent=0, bytes_received=0, error=False):
+        with self._lock:
+            stats = self.rpc[(model, method)]
+            stats.calls += 1
+            stats.errors += int(error)
+            stats.seconds += seconds
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time a phase of the run. Phases entered several times add up."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + (
+                    time.perf_counter() - start
+                )
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def summary(self):
+        with self._lock:
+            return {
+                "started": self.started,
+                "duration": round(time.time() - self.started, 3),
+                "phases": {name: round(s, 3) for name, s in self.phases.items()},
+                "counters": dict(self.counters),
+                "rpc_calls": sum(s.calls for s in self.rpc.values()),
+                "rpc": {
+                    "{}.{}".format(model, method): stats.as_dict()
+                    for (model, method), stats in sorted(self.rpc.items())
+                },
+            }
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.summary()) + "\n")
+
+    def write_prometheus(self, path, prefix="product_updater"):
+        """Write the summary in the Prometheus text format, e.g. for the node exporter textfile collector."""
+        summary = self.summary()
+        lines = [
+            "# TYPE {}_run_duration_seconds gauge".format(prefix),
+            "{}_run_duration_seconds {}".format(prefix, summary["duration"]),
+            "# TYPE {}_run_timestamp_seconds gauge".format(prefix),
+            "{}_run_timestamp_seconds {}".format(prefix, int(summary["started"])),
+            "# TYPE {}_phase_duration_seconds gauge".format(prefix),
+        ]
+        for name, seconds in summary["phases"].items():
+            lines.append(
+                '{}_phase_duration_seconds{{phase="{}"}} {}'.format(prefix, name, seconds)
+            )
+        lines.append("# TYPE {}_count gauge".format(prefix))
+        for name, n in summary["counters"].items():
+            lines.append('{}_count{{name="{}"}} {}'.format(prefix, name, n))
+
+        lines.append("# TYPE {}_rpc_latency_seconds histogram".format(prefix))
+        for (model, method), stats in sorted(self.rpc.items()):
+            labels = 'model="{}",method="{}"'.format(model, method)
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else str(bound)
+                lines.append(
+                    '{}_rpc_latency_seconds_bucket{{{},le="{}"}} {}'.format(
+                        prefix, labels, le, cumulative
+                    )
+                )
+            lines.append(
+                "{}_rpc_latency_seconds_sum{{{}}} {}".format(prefix, labels, stats.seconds)
+            )
+            lines.append(
+                "{}_rpc_latency_seconds_count{{{}}} {}".format(prefix, labels, stats.calls)
+            )
+        for name in ["errors", "bytes_sent", "bytes_received"]:
+            lines.append("# TYPE {}_rpc_{} counter".format(prefix, name))
+            for (model, method), stats in sorted(self.rpc.items()):
+                lines.append(
+                    '{}_rpc_{}{{model="{}",method="{}"}} {}'.format(
+                        prefix, name, model, method, getattr(stats, name)
+                    )
+                )
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+
+def _write_atomic(path, content):
+    with open(path + ".tmp", "w") as f:
+        f.write(content)
+    os.replace(path + ".tmp", path)
+
+
+# Metrics of the current run
+metrics = Metrics()
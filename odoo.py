@@ -1,12 +1,299 @@
+import collections
+import contextlib
+import gzip
+import http.client
+import itertools
+import json
+import os
+import queue
+import time
+import urllib.parse
 import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
+
+import resilience
+from instrumentation import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 ODOO = {
-    "BASE_URL": "https://erp.supercoop.de/",
-    "DATABASE": "odoo",
-    "USERNAME": "product-updater-bot",
-    "PASSWORD": "",
+    "BASE_URL": os.environ.get("ODOO_BASE_URL", "https://erp.supercoop.de/"),
+    "DATABASE": os.environ.get("ODOO_DATABASE", "odoo"),
+    "USERNAME": os.environ.get("ODOO_USERNAME", "product-updater-bot"),
+    "PASSWORD": os.environ.get("ODOO_PASSWORD", ""),
+    # xmlrpc or jsonrpc
+    "PROTOCOL": os.environ.get("ODOO_PROTOCOL", "xmlrpc"),
+    # Only if a proxy in front of Odoo inflates gzip-compressed request bodies
+    "GZIP_REQUESTS": os.environ.get("ODOO_GZIP_REQUESTS", "") == "1",
+    # Seconds to wait for a response
+    "TIMEOUT": float(os.environ.get("ODOO_TIMEOUT", "120")),
+    # Calls that change records per second, 0 for no limit
+    "WRITES_PER_SECOND": float(os.environ.get("ODOO_WRITES_PER_SECOND", "0")),
 }
 
+# Methods that only read and can be called again if a call failed
+READ_METHODS = {"fields_get", "read", "search", "search_count", "search_read"}
+WRITE_METHODS = {"create", "unlink", "write"}
+
+# Shared by all connections, Odoo is one server
+write_limiter = resilience.TokenBucket(ODOO["WRITES_PER_SECOND"])
+
+
+def is_transient_error(e):
+    """Return whether a call that failed with e may succeed when made again."""
+    if isinstance(e, xmlrpc.client.ProtocolError):
+        # Overloaded or restarting behind a proxy
+        return e.errcode in (429, 502, 503, 504)
+    # Faults are errors raised by Odoo itself, calling again gives the same
+    return isinstance(e, (OSError, http.client.HTTPException))
+
+
+class _CountingResponse:
+    """Wraps an HTTP response to count the bytes read from it."""
+
+    def __init__(self, response):
+        self._response = response
+        self.bytes_read = 0
+
+    def getheader(self, *args):
+        return self._response.getheader(*args)
+
+    def read(self, *args):
+        data = self._response.read(*args)
+        self.bytes_read += len(data)
+        return data
+
+
+class _InstrumentedTransportMixin:
+    """Adds a socket timeout and counts the request and response size of the last call.
+
+    Connections are kept alive between calls.
+    """
+
+    def __init__(self, timeout=None, **kwargs):
+        super().__init__(**kwargs)
+        self.timeout = timeout
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        connection.timeout = self.timeout
+        return connection
+
+    def send_content(self, connection, request_body):
+        # Like xmlrpc.client.Transport.send_content, but counts the bytes actually
+        # sent, after compressing the body
+        if self.encode_threshold is not None and self.encode_threshold < len(
+            request_body
+        ):
+            connection.putheader("Content-Encoding", "gzip")
+            request_body = xmlrpc.client.gzip_encode(request_body)
+        self.bytes_sent = len(request_body)
+        connection.putheader("Content-Length", str(len(request_body)))
+        connection.endheaders(request_body)
+
+    def parse_response(self, response):
+        counting_response = _CountingResponse(response)
+        try:
+            return super().parse_response(counting_response)
+        finally:
+            self.bytes_received = counting_response.bytes_read
+
+
+class TimeoutTransport(_InstrumentedTransportMixin, xmlrpc.client.Transport):
+    pass
+
+
+class SafeTimeoutTransport(_InstrumentedTransportMixin, xmlrpc.client.SafeTransport):
+    pass
+
+
+def make_server_proxy(url, timeout=None):
+    if url.startswith("https"):
+        transport = SafeTimeoutTransport(timeout)
+    else:
+        transport = TimeoutTransport(timeout)
+    return xmlrpc.client.ServerProxy(url, transport=transport)
+
+
+def _json_dumps(value):
+    if orjson:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def _json_loads(data):
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class _JsonTransportMixin:
+    """Makes an xmlrpc transport send JSON and return the response body undecoded.
+
+    Connection handling and gzip-compressed responses are left to
+    xmlrpc.client.Transport, compressing requests if encode_threshold is set to
+    _InstrumentedTransportMixin.
+    """
+
+    def send_headers(self, connection, headers):
+        super().send_headers(
+            connection,
+            [
+                (name, "application/json" if name == "Content-Type" else value)
+                for name, value in headers
+            ],
+        )
+
+    def parse_response(self, response):
+        if response.getheader("Content-Encoding", "") == "gzip":
+            return gzip.decompress(response.read())
+        return response.read()
+
+
+class JsonRpcTransport(
+    _InstrumentedTransportMixin, _JsonTransportMixin, xmlrpc.client.Transport
+):
+    pass
+
+
+class SafeJsonRpcTransport(
+    _InstrumentedTransportMixin, _JsonTransportMixin, xmlrpc.client.SafeTransport
+):
+    pass
+
+
+class JsonRpcProxy:
+    """Calls the methods of one Odoo service on its /jsonrpc endpoint like a ServerProxy.
+
+    Request bodies are gzip-compressed if gzip_requests is set.
+    """
+
+    def __init__(self, url, service, timeout=None, gzip_requests=False):
+        url = urllib.parse.urlsplit(url)
+        if url.scheme == "https":
+            self._transport = SafeJsonRpcTransport(timeout)
+        else:
+            self._transport = JsonRpcTransport(timeout)
+        if gzip_requests:
+            self._transport.encode_threshold = 0
+        self._host = url.netloc
+        self._handler = url.path
+        self._service = service
+        self._ids = itertools.count(1)
+
+    def _call(self, method, args):
+        body = _json_dumps(
+            {
+                "jsonrpc": "2.0",
+                "method": "call",
+                "params": {"service": self._service, "method": method, "args": args},
+                "id": next(self._ids),
+            }
+        )
+        result = _json_loads(self._transport.request(self._host, self._handler, body))
+        error = result.get("error")
+        if error:
+            # Raised like the errors of xmlrpc.client, callers need not know the protocol
+            data = error.get("data") or {}
+            raise xmlrpc.client.Fault(
+                error.get("code", 0), data.get("debug") or error.get("message", "")
+            )
+        return result.get("result")
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+        return lambda *args: self._call(method, list(args))
+
+    def __call__(self, attr):
+        if attr == "transport":
+            return self._transport
+        if attr == "close":
+            return self._transport.close
+        raise AttributeError(attr)
+
+
+def make_proxy(base_url, service, timeout=None, protocol="xmlrpc"):
+    """Return a ServerProxy or JsonRpcProxy for an Odoo service, e.g. common or object."""
+    if protocol == "jsonrpc":
+        return JsonRpcProxy(
+            "{}jsonrpc".format(base_url), service, timeout, ODOO["GZIP_REQUESTS"]
+        )
+    if protocol != "xmlrpc":
+        raise ValueError("Unknown Odoo protocol {!r}".format(protocol))
+    return make_server_proxy("{}xmlrpc/2/{}".format(base_url, service), timeout)
+
+
+def execute_kw(models, db, uid, password, entity, method, args, kwargs=None):
+    """Call execute_kw on a proxy from make_proxy.
+
+    Reads are retried after transient errors, writes are limited by write_limiter.
+    Every attempt is recorded in the run metrics.
+    """
+    if method in READ_METHODS:
+        return resilience.retry(
+            lambda: _execute_kw_once(
+                models, db, uid, password, entity, method, args, kwargs
+            ),
+            "{}.{}".format(entity, method),
+            is_transient_error,
+        )
+    if method in WRITE_METHODS:
+        write_limiter.acquire()
+    return _execute_kw_once(models, db, uid, password, entity, method, args, kwargs)
+
+
+def _execute_kw_once(models, db, uid, password, entity, method, args, kwargs):
+    transport = models("transport")
+    transport.bytes_sent = transport.bytes_received = 0
+    start = time.perf_counter()
+    error = False
+    try:
+        return models.execute_kw(db, uid, password, entity, method, args, kwargs or {})
+    except Exception:
+        error = True
+        raise
+    finally:
+        metrics.record_rpc(
+            entity,
+            method,
+            time.perf_counter() - start,
+            transport.bytes_sent,
+            transport.bytes_received,
+            error,
+        )
+
+
+class ServerProxyPool:
+    """Pool of connections to one Odoo service.
+
+    A proxy must not be used by several threads at once, so every thread
+    borrows its own one from the pool.
+    """
+
+    def __init__(self, base_url, service, timeout=None, protocol="xmlrpc"):
+        self.base_url = base_url
+        self.service = service
+        self.timeout = timeout
+        self.protocol = protocol
+        self._idle = queue.LifoQueue()
+
+    @contextlib.contextmanager
+    def proxy(self):
+        try:
+            proxy = self._idle.get_nowait()
+        except queue.Empty:
+            proxy = make_proxy(self.base_url, self.service, self.timeout, self.protocol)
+        try:
+            yield proxy
+        finally:
+            self._idle.put(proxy)
+
 
 class OdooAPI:
     """Class to handle Odoo API requests."""
@@ -17,6 +304,11 @@ class OdooAPI:
     _common = None
     _uid = None
     _models = None
+    _models_pool = None
+
+    # Defaults for search_read_iter
+    read_page_size = 1000
+    read_workers = 4
 
     @classmethod
     def get_connection(cls):
@@ -26,82 +318,123 @@ class OdooAPI:
                 ODOO["DATABASE"],
                 ODOO["USERNAME"],
                 ODOO["PASSWORD"],
+                ODOO["PROTOCOL"],
+                ODOO["TIMEOUT"],
             )
         return cls._connection
 
-    def __init__(self, base_url, db, user, password):
-        """Initialize xmlrpc connection."""
+    def __init__(self, base_url, db, user, password, protocol="xmlrpc", timeout=None):
+        """Initialize the connection over xmlrpc or jsonrpc."""
+        self._base_url = base_url
         self._db = db
         self._username = user
         self._password = password
+        self._protocol = protocol
+        self._timeout = timeout
 
-        self._common = xmlrpc.client.ServerProxy("{}xmlrpc/2/common".format(base_url))
-        self._uid = self._common.authenticate(
-            self._db, self._username, self._password, {}
+        self._common = make_proxy(base_url, "common", timeout, protocol)
+        self._uid = resilience.retry(
+            lambda: self._common.authenticate(
+                self._db, self._username, self._password, {}
+            ),
+            "Logging in to Odoo",
+            is_transient_error,
         )
-        self._models = xmlrpc.client.ServerProxy("{}xmlrpc/2/object".format(base_url))
+        self._models = make_proxy(base_url, "object", timeout, protocol)
+        self._models_pool = ServerProxyPool(base_url, "object", timeout, protocol)
 
-    def fields_get(self, entity):
-        fields = self._models.execute_kw(
+    def _execute_kw(self, entity, method, args, kwargs=None, models=None):
+        return execute_kw(
+            models or self._models,
             self._db,
             self._uid,
             self._password,
             entity,
-            "fields_get",
-            [],
-            {"attributes": ["string", "help", "type"]},
+            method,
+            args,
+            kwargs,
+        )
+
+    def fields_get(self, entity):
+        fields = self._execute_kw(
+            entity, "fields_get", [], {"attributes": ["string", "help", "type"]}
         )
         return fields
 
     def search_count(self, entity, cond=[]):
-        return self._models.execute_kw(
-            self._db, self._uid, self._password, entity, "search_count", [cond]
-        )
+        return self._execute_kw(entity, "search_count", [cond])
+
+    def search(self, entity, cond=[], limit=None, order="id ASC"):
+        kwargs = {"order": order}
+        if limit:
+            kwargs["limit"] = limit
+        return self._execute_kw(entity, "search", [cond], kwargs)
 
     def search_read(
-        self, entity, cond=[], fields=[], limit=3500, offset=0, order="id ASC"
+        self, entity, cond=[], fields=[], limit=None, offset=0, order="id ASC"
     ):
         fields_and_context = {
             "fields": fields,
-            "limit": limit,
             "offset": offset,
             "order": order,
         }
-        return self._models.execute_kw(
-            self._db,
-            self._uid,
-            self._password,
-            entity,
-            "search_read",
-            [cond],
-            fields_and_context,
-        )
+        # No limit means all records
+        if limit:
+            fields_and_context["limit"] = limit
+        return self._execute_kw(entity, "search_read", [cond], fields_and_context)
+
+    def search_read_iter(
+        self, entity, cond=[], fields=[], order="id ASC", page_size=None, workers=None
+    ):
+        """Yield all records matching cond, reading them in pages.
+
+        The matching IDs are searched first, so records that stop matching cond while
+        iterating (e.g. because they were just written) do not shift the pages. Up to
+        workers pages are read in parallel over separate connections. Records are
+        yielded in order as soon as their page has arrived.
+        """
+        page_size = page_size or self.read_page_size
+        workers = workers or self.read_workers
+        ids = self.search(entity, cond, order=order)
+
+        def read_page(page_ids):
+            with self._models_pool.proxy() as models:
+                return self._execute_kw(
+                    entity, "read", [page_ids], {"fields": fields}, models=models
+                )
+
+        pages_ids = (ids[i : i + page_size] for i in range(0, len(ids), page_size))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Keep a bounded number of pages in flight so that a slow consumer
+            # does not end up with the whole table in memory
+            pages = collections.deque(
+                executor.submit(read_page, page_ids)
+                for _, page_ids in zip(range(2 * workers), pages_ids)
+            )
+            while pages:
+                page = pages.popleft().result()
+                page_ids = next(pages_ids, None)
+                if page_ids is not None:
+                    pages.append(executor.submit(read_page, page_ids))
+                yield from page
 
     def get(self, entity, cond=[], fields=[]):
-        r = self.search_read(entity, cond=cond, fields=fields)
+        r = self.search_read(entity, cond=cond, fields=fields, limit=1)
         if len(r) > 0:
             return r[0]
         return None
 
     def write(self, entity, ids, fields):
-        return self._models.execute_kw(
-            self._db, self._uid, self._password, entity, "write", [ids, fields]
-        )
+        return self._execute_kw(entity, "write", [ids, fields])
 
     def unlink(self, entity, ids):
-        return self._models.execute_kw(
-            self._db, self._uid, self._password, entity, "unlink", [ids]
-        )
+        return self._execute_kw(entity, "unlink", [ids])
 
     def create(self, entity, fields):
-        return self._models.execute_kw(
-            self._db, self._uid, self._password, entity, "create", [fields]
-        )
+        return self._execute_kw(entity, "create", [fields])
 
     def execute(self, entity, method, ids, params={}):
-        return self._models.execute_kw(
-            self._db, self._uid, self._password, entity, method, [ids], params
-        )
+        return self._execute_kw(entity, method, [ids], params)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,152 @@
+import asyncio
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from odoo import ODOO, ServerProxyPool, execute_kw, make_proxy
+
+
+class AsyncOdooAPI:
+    """asyncio variant of OdooAPI.
+
+    Calls are made over a bounded pool of keep-alive connections, at most
+    concurrency of them at the same time, so that many calls can be awaited
+    together without overloading the Odoo server. A call fails after timeout
+    seconds without response, like the calls of OdooAPI.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        db,
+        uid,
+        password,
+        concurrency=4,
+        timeout=60,
+        protocol="xmlrpc",
+        pool=None,
+    ):
+        self._db = db
+        self._uid = uid
+        self._password = password
+        self.concurrency = concurrency
+
+        self._pool = pool or ServerProxyPool(base_url, "object", timeout, protocol)
+        # The executor bounds the number of calls and thereby connections in flight
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    @classmethod
+    async def connect(cls, base_url, db, user, password, protocol="xmlrpc", **kwargs):
+        common = make_proxy(base_url, "common", protocol=protocol)
+        uid = await asyncio.get_running_loop().run_in_executor(
+            None, common.authenticate, db, user, password, {}
+        )
+        return cls(base_url, db, uid, password, protocol=protocol, **kwargs)
+
+    @classmethod
+    async def get_connection(cls, **kwargs):
+        return await cls.connect(
+            ODOO["BASE_URL"],
+            ODOO["DATABASE"],
+            ODOO["USERNAME"],
+            ODOO["PASSWORD"],
+            ODOO["PROTOCOL"],
+            **kwargs,
+        )
+
+    @classmethod
+    def from_connection(cls, c, **kwargs):
+        """Create an AsyncOdooAPI sharing the login and connections of a synchronous OdooAPI."""
+        return cls(
+            c._base_url,
+            c._db,
+            c._uid,
+            c._password,
+            protocol=c._protocol,
+            pool=c._models_pool,
+            **kwargs,
+        )
+
+    def close(self):
+        self._executor.shutdown()
+
+    async def _execute_kw(self, entity, method, args, kwargs=None):
+        def call():
+            with self._pool.proxy() as models:
+                return execute_kw(
+                    models,
+                    self._db,
+                    self._uid,
+                    self._password,
+                    entity,
+                    method,
+                    args,
+                    kwargs,
+                )
+
+        # A thread cannot be cancelled, the timeout of the connection ends the call
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    async def fields_get(self, entity):
+        return await self._execute_kw(
+            entity, "fields_get", [], {"attributes": ["string", "help", "type"]}
+        )
+
+    async def search_count(self, entity, cond=[]):
+        return await self._execute_kw(entity, "search_count", [cond])
+
+    async def search(self, entity, cond=[], limit=None, order="id ASC"):
+        kwargs = {"order": order}
+        if limit:
+            kwargs["limit"] = limit
+        return await self._execute_kw(entity, "search", [cond], kwargs)
+
+    async def search_read(
+        self, entity, cond=[], fields=[], limit=None, offset=0, order="id ASC"
+    ):
+        kwargs = {"fields": fields, "offset": offset, "order": order}
+        if limit:
+            kwargs["limit"] = limit
+        return await self._execute_kw(entity, "search_read", [cond], kwargs)
+
+    async def get(self, entity, cond=[], fields=[]):
+        r = await self.search_read(entity, cond=cond, fields=fields, limit=1)
+        if len(r) > 0:
+            return r[0]
+        return None
+
+    async def write(self, entity, ids, fields):
+        return await self._execute_kw(entity, "write", [ids, fields])
+
+    async def unlink(self, entity, ids):
+        return await self._execute_kw(entity, "unlink", [ids])
+
+    async def create(self, entity, fields):
+        return await self._execute_kw(entity, "create", [fields])
+
+    async def execute(self, entity, method, ids, params={}):
+        return await self._execute_kw(entity, method, [ids], params)
+
+
+# AsyncOdooAPI of every OdooAPI used with run_concurrently
+_async_connections = weakref.WeakKeyDictionary()
+
+
+def run_concurrently(c, calls, concurrency=4):
+    """Run (method name, args) calls on an AsyncOdooAPI built from c, return their results in order.
+
+    The AsyncOdooAPI is kept for the next calls with c, so its threads and the
+    connections of c are reused.
+    """
+    async_c = _async_connections.get(c)
+    if async_c is None or async_c.concurrency != concurrency:
+        if async_c:
+            async_c.close()
+        async_c = AsyncOdooAPI.from_connection(c, concurrency=concurrency)
+        _async_connections[c] = async_c
+
+    async def run():
+        return await asyncio.gather(
+            *(getattr(async_c, method)(*args) for method, args in calls)
+        )
+
+    return asyncio.run(run())
@@ -0,0 +1,200 @@
+"""Local copy of the Odoo records the updater reads, kept in SQLite in the cache directory.
+
+Every sync only reads the records written since the previous one (by write_date) and
+drops the ones that no longer exist. Writes and creates sent by the updater itself are
+applied to the copy right away, in the format read returns them.
+"""
+import datetime
+import json
+import logging
+import sqlite3
+
+import catalog_cache
+
+logger = logging.getLogger(__name__)
+
+# Odoo sets write_date to the start of the transaction, which may commit after a sync
+# has looked. Records written this long before the newest one seen are read again.
+SYNC_OVERLAP = datetime.timedelta(minutes=10)
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class OdooSnapshot:
+    """Records of several models, each with the given fields.
+
+    Binary fields are not copied, only whether they are set, as has_<field>.
+    """
+
+    def __init__(self, c, models, filename="odoo.sqlite"):
+        self._c = c
+        self.models = models
+        self._db = sqlite3.connect(catalog_cache.cache_path(filename))
+        # Every write of the updater is committed, make that cheap. A commit lost
+        # in a crash is made up for by the next sync.
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS records"
+                " (model TEXT, id INTEGER, data TEXT, PRIMARY KEY (model, id))"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS models"
+                " (model TEXT PRIMARY KEY, fields TEXT, types TEXT, last_write_date TEXT)"
+            )
+        self._types = {}
+
+    def sync(self):
+        for model in self.models:
+            self._sync(model)
+
+    def _sync(self, model):
+        c = self._c
+        fields = self.models[model]
+        row = self._db.execute(
+            "SELECT fields, types, last_write_date FROM models WHERE model = ?",
+            (model,),
+        ).fetchone()
+        if row and json.loads(row[0]) == fields:
+            types = json.loads(row[1])
+            last_write_date = row[2]
+        else:
+            # Not synced yet or with other fields, start over
+            types = {
+                name: field["type"]
+                for name, field in c.fields_get(model).items()
+                if name in fields
+            }
+            last_write_date = None
+        self._types[model] = types
+        binary_fields = [name for name in fields if types.get(name) == "binary"]
+        read_fields = [name for name in fields if name not in binary_fields]
+
+        cond = []
+        if last_write_date:
+            since = datetime.datetime.strptime(last_write_date, DATETIME_FORMAT)
+            cond = [
+                ["write_date", ">=", (since - SYNC_OVERLAP).strftime(DATETIME_FORMAT)]
+            ]
+        records = list(
+            c.search_read_iter(model, cond, fields=read_fields + ["write_date"])
+        )
+        for name in binary_fields:
+            unset = set()
+            if records:
+                unset = set(c.search(model, cond + [[name, "=", False]]))
+            for r in records:
+                r["has_" + name] = r["id"] not in unset
+        if records:
+            last_write_date = max(
+                [r.pop("write_date") or "" for r in records] + [last_write_date or ""]
+            )
+
+        with self._db:
+            if not cond:
+                self._db.execute("DELETE FROM records WHERE model = ?", (model,))
+            else:
+                existing = set(c.search(model, []))
+                deleted = [
+                    (model, i)
+                    for (i,) in self._db.execute(
+                        "SELECT id FROM records WHERE model = ?", (model,)
+                    )
+                    if i not in existing
+                ]
+                self._db.executemany(
+                    "DELETE FROM records WHERE model = ? AND id = ?", deleted
+                )
+            self._store(model, records)
+            self._db.execute(
+                "INSERT OR REPLACE INTO models VALUES (?, ?, ?, ?)",
+                (model, json.dumps(fields), json.dumps(types), last_write_date),
+            )
+        logger.debug("Synced %d %s records", len(records), model)
+
+    def _store(self, model, records):
+        self._db.executemany(
+            "INSERT OR REPLACE INTO records VALUES (?, ?, ?)",
+            ((model, r["id"], json.dumps(r)) for r in records),
+        )
+
+    def records(self, model, ids=None):
+        """Return the records of model in ID order, only the ones with the given IDs if set."""
+        wanted = None if ids is None else set(ids)
+        return [
+            json.loads(data)
+            for i, data in self._db.execute(
+                "SELECT id, data FROM records WHERE model = ? ORDER BY id", (model,)
+            )
+            if wanted is None or i in wanted
+        ]
+
+    def _field_types(self, model):
+        if model not in self._types:
+            row = self._db.execute(
+                "SELECT types FROM models WHERE model = ?", (model,)
+            ).fetchone()
+            self._types[model] = json.loads(row[0]) if row else {}
+        return self._types[model]
+
+    def _normalize(self, model, fields):
+        # Values as read returns them, e.g. [id, name] for many2one fields
+        types = self._field_types(model)
+        normalized = {}
+        for name, value in fields.items():
+            field_type = types.get(name)
+            if name not in self.models[model]:
+                continue
+            if field_type == "binary":
+                normalized["has_" + name] = bool(value)
+            elif field_type == "many2one":
+                normalized[name] = [value, ""] if value else False
+            elif field_type in ("many2many", "one2many"):
+                ids = []
+                for command in value or []:
+                    if isinstance(command, (list, tuple)):
+                        # Only (6, 0, ids) is used by the updater
+                        ids = list(command[2])
+                    else:
+                        ids.append(command)
+                normalized[name] = ids
+            elif field_type in ("float", "monetary") and isinstance(value, str):
+                normalized[name] = float(value)
+            else:
+                normalized[name] = value
+        return normalized
+
+    def written(self, model, ids, fields):
+        """Apply a write sent to Odoo to the records of the snapshot."""
+        if model not in self.models:
+            return
+        normalized = self._normalize(model, fields)
+        records = []
+        for start in range(0, len(ids), 500):
+            chunk = ids[start : start + 500]
+            records += [
+                json.loads(data)
+                for (data,) in self._db.execute(
+                    "SELECT data FROM records WHERE model = ? AND id IN ({})".format(
+                        ",".join("?" * len(chunk))
+                    ),
+                    [model] + list(chunk),
+                )
+            ]
+        for r in records:
+            r.update(normalized)
+        with self._db:
+            self._store(model, records)
+
+    def created(self, model, ids, values):
+        """Add records created in Odoo with the given values to the snapshot."""
+        if model not in self.models:
+            return
+        records = []
+        for record_id, fields in zip(ids, values):
+            # Records created with fewer fields than we keep are read by the next sync
+            if all(name in fields for name in self.models[model]):
+                records.append({**self._normalize(model, fields), "id": record_id})
+        with self._db:
+            self._store(model, records)
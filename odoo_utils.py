@@ -1,32 +1,228 @@
-import functools
+import collections
+import json
+import logging
 from decimal import Decimal
 
-@functools.lru_cache()
-def get_or_create_uom(c, num, category_id=None):
-    category_id = category_id or 1
-    category_name_suffix = {
+import odoo_async
+
+logger = logging.getLogger(__name__)
+
+
+class RecordIndex:
+    """Index of Odoo records by the ID in a many2one field, e.g. product_tmpl_id.
+
+    Several records can share the same ID, they are kept in the order they were added.
+    """
+
+    def __init__(self, records, field):
+        self.field = field
+        self._records_by_id = collections.defaultdict(list)
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        # many2one values are [id, display_name] or False if not set
+        value = record[self.field]
+        if value:
+            self._records_by_id[value[0]].append(record)
+
+    def get_all(self, record_id):
+        return self._records_by_id.get(record_id, [])
+
+    def get(self, record_id, predicate=None):
+        """Return the first record for record_id, preferring ones matching predicate."""
+        records = self.get_all(record_id)
+        if predicate:
+            return next(filter(predicate, records), next(iter(records), None))
+        return next(iter(records), None)
+
+
+class BatchWriter:
+    """Collects write and create calls and sends them to Odoo in as few calls as possible.
+
+    Writes of identical field values to records of the same model are sent as one
+    write with all record IDs, creates are sent as one multi-record create per model.
+    Nothing is sent before flush() is called or batch_size records are pending for
+    a call. flush() sends up to concurrency calls at the same time. on_sent is
+    called with the method, model, IDs and values of every call that was sent.
+    """
+
+    def __init__(self, c, batch_size=500, concurrency=1, on_sent=None):
+        self._c = c
+        self.on_sent = on_sent
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        # (entity, serialized fields) -> (fields, ids), in the order of the first write
+        self._writes = dict()
+        self._pending_write_ids = collections.defaultdict(set)
+        self._creates = collections.defaultdict(list)
+        # IDs of all records written or created so far, by model
+        self.written_ids = collections.defaultdict(set)
+
+    def write(self, entity, ids, fields):
+        # Writes to the same record must not overtake each other
+        if self._pending_write_ids[entity].intersection(ids):
+            self.flush_writes()
+
+        key = (entity, json.dumps(fields, sort_keys=True, default=str))
+        _, pending_ids = self._writes.setdefault(key, (fields, []))
+        pending_ids.extend(ids)
+        self._pending_write_ids[entity].update(ids)
+        if len(pending_ids) >= self.batch_size:
+            self._send([self._pop_write(key)])
+
+    def create(self, entity, fields):
+        self._creates[entity].append(fields)
+        if len(self._creates[entity]) >= self.batch_size:
+            self._send([self._pop_create(entity)])
+
+    def _pop_write(self, key):
+        entity, _ = key
+        fields, ids = self._writes.pop(key)
+        self._pending_write_ids[entity].difference_update(ids)
+        logger.debug("Writing %d %s records: %s", len(ids), entity, fields)
+        return "write", (entity, ids, fields)
+
+    def _pop_create(self, entity):
+        values = self._creates.pop(entity)
+        logger.debug("Creating %d %s records", len(values), entity)
+        return "create", (entity, values)
+
+    def _send(self, calls):
+        if self.concurrency > 1 and len(calls) > 1:
+            results = odoo_async.run_concurrently(self._c, calls, self.concurrency)
+        else:
+            results = [getattr(self._c, method)(*args) for method, args in calls]
+
+        for (method, args), result in zip(calls, results):
+            entity = args[0]
+            ids = result if method == "create" else args[1]
+            self.written_ids[entity].update(ids)
+            if self.on_sent:
+                self.on_sent(method, entity, ids, args[-1])
+
+    def flush_writes(self):
+        self._send([self._pop_write(key) for key in list(self._writes)])
+
+    def flush(self):
+        # Pending writes never touch the same record twice, so all calls can run concurrently
+        self._send(
+            [self._pop_write(key) for key in list(self._writes)]
+            + [self._pop_create(entity) for entity in list(self._creates)]
+        )
+
+
+class UomRegistry:
+    """All units of measure in Odoo, read in one call and indexed by ID and by factor.
+
+    Factors are compared rounded, Odoo returns them as floats that do not always
+    round-trip to the value they were written with.
+    """
+
+    FIELDS = ["name", "category_id", "factor", "factor_inv", "rounding", "uom_type"]
+    CATEGORY_NAME_SUFFIX = {
         1: "Unit(s)",
         2: "kg",
-    }[category_id]
-    factor = Decimal("1.0") / Decimal(num)
-    search_result = c.search_read(
-        "uom.uom",
-        cond=[
-            ["factor", "=", str(factor)],
-            ["rounding", "=", "1.0"],
-            ["category_id", "=", category_id],
-        ],
-    )
-    if search_result:
-        return int(search_result[0]["id"])
-
-    return c.create(
-        "uom.uom",
-        {
-            "name": "{} {}".format(num, category_name_suffix),
-            "category_id": category_id,
-            "factor": str(factor),
-            "rounding": "1.0",
-            "uom_type": "bigger",
-        },
-    )
+    }
+
+    def __init__(self, c, changeset=None):
+        self._c = c
+        # Missing units are recorded in the changeset instead of created if given
+        self.changeset = changeset
+        self._by_id = None
+        self._by_factor = None
+
+    def __getstate__(self):
+        # Copies sent to other processes only look up the units loaded so far
+        return {**self.__dict__, "_c": None, "changeset": None}
+
+    @staticmethod
+    def _key(factor, rounding, category_id):
+        return (round(float(factor), 8), round(float(rounding), 8), category_id)
+
+    def _add(self, uom):
+        self._by_id[uom["id"]] = uom
+        key = self._key(uom["factor"], uom["rounding"], uom["category_id"][0])
+        # Prefer the oldest one if there are duplicates, like searching did
+        self._by_factor.setdefault(key, uom["id"])
+
+    def load(self):
+        self._by_id = {}
+        self._by_factor = {}
+        for uom in sorted(
+            self._c.search_read("uom.uom", [], fields=self.FIELDS),
+            key=lambda uom: uom["id"],
+        ):
+            self._add(uom)
+
+    def clear(self):
+        """Read the units again when they are used next."""
+        self._by_id = None
+
+    def get(self, uom_id):
+        if self._by_id is None:
+            self.load()
+        if uom_id not in self._by_id:
+            # Created in Odoo since we loaded them
+            for uom in self._c.search_read(
+                "uom.uom", [["id", "=", uom_id]], fields=self.FIELDS
+            ):
+                self._add(uom)
+        return self._by_id.get(uom_id)
+
+    def find(self, factor, rounding, category_id):
+        """Return the ID of the unit with the given factor, rounding and category, or None."""
+        if self._by_id is None:
+            self.load()
+        return self._by_factor.get(self._key(factor, rounding, category_id))
+
+    def _purchase_key(self, num, category_id):
+        return self._key(Decimal("1.0") / Decimal(num), 1, category_id or 1)
+
+    def find_purchase_uom(self, num, category_id=None):
+        """Return the ID of the unit containing num reference units, or None."""
+        if self._by_id is None:
+            self.load()
+        return self._by_factor.get(self._purchase_key(num, category_id))
+
+    def create_purchase_uoms(self, units):
+        """Create the missing units of the (num, category_id) pairs in one call."""
+        missing = {}
+        for num, category_id in units:
+            if self.find_purchase_uom(num, category_id) is None:
+                missing.setdefault(
+                    self._purchase_key(num, category_id), (num, category_id or 1)
+                )
+        if not missing:
+            return
+        values = [
+            {
+                "name": "{} {}".format(num, self.CATEGORY_NAME_SUFFIX[category_id]),
+                "category_id": category_id,
+                "factor": str(Decimal("1.0") / Decimal(num)),
+                "rounding": "1.0",
+                "uom_type": "bigger",
+            }
+            for num, category_id in sorted(missing.values())
+        ]
+        if self.changeset is not None:
+            refs = self.changeset.create_referenced("uom.uom", values)
+            for ref, fields in zip(refs, values):
+                factor = float(fields["factor"])
+                self._add(
+                    {
+                        **fields,
+                        "id": ref,
+                        "category_id": [fields["category_id"], ""],
+                        "factor": factor,
+                        "factor_inv": 1 / factor,
+                        "rounding": 1.0,
+                    }
+                )
+            return
+        logger.info("Creating %d units of measure", len(values))
+        ids = self._c.create("uom.uom", values)
+        for uom in self._c.search_read(
+            "uom.uom", [["id", "in", ids]], fields=self.FIELDS
+        ):
+            self._add(uom)
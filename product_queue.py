@@ -0,0 +1,167 @@
+"""Sources of IDs of products that should be updated right away.
+
+Other programs can drop files with product IDs into a spool directory or write them to
+stdin, and OdooChanges finds products whose barcode or importer setting was just changed
+in Odoo. IDs are separated by whitespace or commas. A source keeps the IDs it returned
+from take() until done() is called, so IDs of a failed update are returned again.
+"""
+import datetime
+import logging
+import os
+import re
+import sys
+import threading
+
+import catalog_cache
+from odoo_snapshot import DATETIME_FORMAT, SYNC_OVERLAP
+
+logger = logging.getLogger(__name__)
+
+
+def parse_ids(text):
+    ids = []
+    for token in re.split(r"[\s,]+", text.strip()):
+        if not token:
+            continue
+        try:
+            ids.append(int(token))
+        except ValueError:
+            logger.warning("Ignoring %r, not a product ID", token)
+    return ids
+
+
+class SpoolDir:
+    """Product IDs from the files in a directory, which are removed once done.
+
+    Files starting with a dot are skipped, write to one and rename it to hand it over.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._taken = []
+
+    def take(self, wait=False):
+        ids = set()
+        self._taken = []
+        for name in sorted(os.listdir(self.path)):
+            path = os.path.join(self.path, name)
+            if name.startswith(".") or not os.path.isfile(path):
+                continue
+            with open(path) as f:
+                ids.update(parse_ids(f.read()))
+            self._taken.append(path)
+        return sorted(ids)
+
+    def done(self):
+        for path in self._taken:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._taken = []
+
+
+class StdinQueue:
+    """Product IDs from the lines of a stream, read in a thread as they arrive."""
+
+    def __init__(self, stream=sys.stdin):
+        self._stream = stream
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._taken = set()
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+    def _read(self):
+        for line in self._stream:
+            ids = parse_ids(line)
+            with self._lock:
+                self._pending.update(ids)
+
+    def take(self, wait=False):
+        """Return the IDs read so far, all of them until the end of the stream if wait."""
+        if wait:
+            self._thread.join()
+        with self._lock:
+            self._taken = set(self._pending)
+        return sorted(self._taken)
+
+    def done(self):
+        with self._lock:
+            self._pending -= self._taken
+        self._taken = set()
+
+
+def open_source(source):
+    """Return the queue for a --ids argument, - for stdin or a spool directory."""
+    if source == "-":
+        return StdinQueue()
+    return SpoolDir(source)
+
+
+class OdooChanges:
+    """Enabled products created in Odoo or whose barcode or importer setting changed.
+
+    Changes since the previous call are found by write_date. The values seen last are
+    kept in the cache directory; the first call only reads them for all products and
+    returns nothing. Writes of the updater itself change write_date but not these
+    fields, so they do not queue products again.
+    """
+
+    FIELDS = ["barcode", "product_importer_script_behavior"]
+
+    def __init__(self, c, filename="odoo-changes.json"):
+        self._c = c
+        self.filename = filename
+        self._state = None
+        self._taken = None
+
+    def take(self, wait=False):
+        if self._state is None:
+            self._state = catalog_cache.read_state(self.filename)
+        state = self._state
+        cond = []
+        if state:
+            since = datetime.datetime.strptime(
+                state["last_write_date"], DATETIME_FORMAT
+            )
+            cond = [
+                ["write_date", ">=", (since - SYNC_OVERLAP).strftime(DATETIME_FORMAT)]
+            ]
+        records = list(
+            self._c.search_read_iter(
+                "product.template", cond, fields=self.FIELDS + ["write_date"]
+            )
+        )
+
+        values = dict(state["values"]) if state else {}
+        changed = []
+        for r in records:
+            seen = [r[field] for field in self.FIELDS]
+            # JSON object keys are strings
+            if (
+                state
+                and values.get(str(r["id"])) != seen
+                and r["product_importer_script_behavior"] == "enabled"
+            ):
+                changed.append(r["id"])
+            values[str(r["id"])] = seen
+        last_write_date = max(
+            [r["write_date"] or "" for r in records]
+            + [state["last_write_date"] if state else ""]
+        )
+        # Saved by done(), after the changed products were updated
+        self._taken = {"last_write_date": last_write_date, "values": values}
+        if not state:
+            self.done()
+        elif changed:
+            logger.info("%d products changed in Odoo", len(changed))
+        return sorted(changed)
+
+    def done(self):
+        if self._taken is None:
+            return
+        if self._taken != self._state and self._taken["last_write_date"]:
+            catalog_cache.write_state(self.filename, self._taken)
+            self._state = self._taken
+        self._taken = None
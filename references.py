@@ -0,0 +1,255 @@
+"""IDs of the Odoo records the updater refers to, e.g. taxes, accounts and suppliers.
+
+They are looked up by XML ID, account code or name within the company instead of being
+hard-coded, so they survive restoring or migrating the database. All of them are looked
+up together when the first one is needed, with one call per model, and kept in the
+cache directory for CACHE_TTL seconds. Every run warns about IDs that differ from the
+ones that used to be hard-coded, because products are written with them.
+"""
+import logging
+import time
+
+import catalog_cache
+from odoo import OdooAPI
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = "references.json"
+CACHE_TTL = 24 * 60 * 60
+
+# Company the taxes and accounts belong to
+COMPANY_ID = 1
+
+# name -> (model, fields identifying the record, ID it had when it was hard-coded).
+# xml_id is looked up in ir.model.data, the other fields must have these values.
+# The old ID is used if no record matches, and preferred if several do.
+REFERENCES = {
+    "tax_ust_7": (
+        "account.tax",
+        {
+            "xml_id": "l10n_de_skr04.1_tax_ust_7_skr04",
+            "company_id": COMPANY_ID,
+            "type_tax_use": "sale",
+            "amount_type": "percent",
+            "amount": 7.0,
+        },
+        109,
+    ),
+    "tax_ust_19": (
+        "account.tax",
+        {
+            "xml_id": "l10n_de_skr04.1_tax_ust_19_skr04",
+            "company_id": COMPANY_ID,
+            "type_tax_use": "sale",
+            "amount_type": "percent",
+            "amount": 19.0,
+        },
+        108,
+    ),
+    "tax_vst_7": (
+        "account.tax",
+        {
+            "xml_id": "l10n_de_skr04.1_tax_vst_7_skr04",
+            "company_id": COMPANY_ID,
+            "type_tax_use": "purchase",
+            "amount_type": "percent",
+            "amount": 7.0,
+        },
+        118,
+    ),
+    "tax_vst_19": (
+        "account.tax",
+        {
+            "xml_id": "l10n_de_skr04.1_tax_vst_19_skr04",
+            "company_id": COMPANY_ID,
+            "type_tax_use": "purchase",
+            "amount_type": "percent",
+            "amount": 19.0,
+        },
+        117,
+    ),
+    "tax_pfand_8_ct": (
+        "account.tax",
+        {
+            "company_id": COMPANY_ID,
+            "type_tax_use": "sale",
+            "amount_type": "fixed",
+            "amount": 0.08,
+        },
+        176,
+    ),
+    "tax_pfand_15_ct": (
+        "account.tax",
+        {
+            "company_id": COMPANY_ID,
+            "type_tax_use": "sale",
+            "amount_type": "fixed",
+            "amount": 0.15,
+        },
+        175,
+    ),
+    "account_income_7": (
+        "account.account",
+        {"company_id": COMPANY_ID, "code": "4300"},
+        1864,
+    ),
+    "account_income_19": (
+        "account.account",
+        {"company_id": COMPANY_ID, "code": "4400"},
+        1874,
+    ),
+    "account_expense_7": (
+        "account.account",
+        {"company_id": COMPANY_ID, "code": "5300"},
+        2025,
+    ),
+    "account_expense_19": (
+        "account.account",
+        {"company_id": COMPANY_ID, "code": "5400"},
+        2027,
+    ),
+    "partner_terra": (
+        "res.partner",
+        {"name": "Terra Naturkost Handels KG", "is_company": True, "parent_id": False},
+        11,
+    ),
+    "partner_agidra": (
+        "res.partner",
+        {"name": "AGIDRA", "is_company": True, "parent_id": False},
+        362,
+    ),
+    "category_glutenfrei": ("product.public.category", {"name": "Glutenfrei"}, None),
+}
+
+_ids = None
+
+
+def _spec():
+    return {name: [model, fields] for name, (model, fields, _) in REFERENCES.items()}
+
+
+def _value(value):
+    # many2one values are [id, display_name]
+    return value[0] if isinstance(value, list) else value
+
+
+def _lookup(c):
+    """Return the IDs of the references that some record matches, by name.
+
+    Raises ValueError if several records match one and none of them has its old ID.
+    """
+    xml_ids = {
+        name: fields["xml_id"]
+        for name, (model, fields, _) in REFERENCES.items()
+        if "xml_id" in fields
+    }
+    res_ids = {}
+    if xml_ids:
+        cond = ["|"] * (len(xml_ids) - 1)
+        for xml_id in xml_ids.values():
+            module, _, xml_name = xml_id.partition(".")
+            cond += ["&", ["module", "=", module], ["name", "=", xml_name]]
+        by_xml_id = {
+            "{}.{}".format(d["module"], d["name"]): (d["model"], d["res_id"])
+            for d in c.search_read(
+                "ir.model.data", cond, fields=["module", "name", "model", "res_id"]
+            )
+        }
+        for name, xml_id in xml_ids.items():
+            model = REFERENCES[name][0]
+            if xml_id in by_xml_id and by_xml_id[xml_id][0] == model:
+                res_ids[name] = by_xml_id[xml_id][1]
+
+    # One search per model for all its references, the ones with an XML ID by ID
+    by_model = {}
+    for name, (model, fields, _) in REFERENCES.items():
+        fields = {field: value for field, value in fields.items() if field != "xml_id"}
+        if "xml_id" in REFERENCES[name][1]:
+            if name not in res_ids:
+                continue
+            fields["id"] = res_ids[name]
+        by_model.setdefault(model, {})[name] = fields
+
+    found = {}
+    for model, refs in by_model.items():
+        cond = ["|"] * (len(refs) - 1)
+        for fields in refs.values():
+            cond += ["&"] * (len(fields) - 1)
+            cond += [[field, "=", value] for field, value in fields.items()]
+        read_fields = sorted(
+            {field for fields in refs.values() for field in fields} - {"id"}
+        )
+        records = c.search_read(model, cond, fields=read_fields)
+        for name, fields in refs.items():
+            # Compared again, the search returns the matches of all references
+            matches = [
+                r["id"]
+                for r in records
+                if all(_value(r[field]) == value for field, value in fields.items())
+            ]
+            old_id = REFERENCES[name][2]
+            if len(matches) > 1 and old_id not in matches:
+                raise ValueError(
+                    "{} {} all match {}, set the one to use in REFERENCES".format(
+                        model, matches, name
+                    )
+                )
+            if matches:
+                found[name] = old_id if old_id in matches else matches[0]
+    return found
+
+
+def load(connect=OdooAPI.get_connection):
+    """Make sure the IDs are loaded, from the cache file or else from Odoo."""
+    global _ids
+    if _ids is not None:
+        return
+    cached = catalog_cache.read_state(CACHE_FILE)
+    if (
+        cached
+        and cached["spec"] == _spec()
+        and time.time() - cached["looked_up"] < CACHE_TTL
+    ):
+        ids = cached["ids"]
+        looked_up = False
+    else:
+        found = _lookup(connect())
+        ids = {}
+        for name, (model, fields, old_id) in REFERENCES.items():
+            if name in found:
+                ids[name] = found[name]
+            else:
+                logger.warning(
+                    "No %s with %s, using ID %s for %s", model, fields, old_id, name
+                )
+                ids[name] = old_id
+        catalog_cache.write_state(
+            CACHE_FILE, {"spec": _spec(), "looked_up": time.time(), "ids": ids}
+        )
+        looked_up = True
+
+    # Every product is written with the new ID, make sure somebody notices. Warn
+    # once per lookup, not on every run while the IDs come from the cache file.
+    for name, (model, _, old_id) in REFERENCES.items():
+        if old_id is not None and ids[name] != old_id:
+            logger.log(
+                logging.WARNING if looked_up else logging.INFO,
+                "Using %s %d for %s instead of %d",
+                model,
+                ids[name],
+                name,
+                old_id,
+            )
+    _ids = ids
+
+
+def get(name):
+    """Return the ID of a record in REFERENCES."""
+    load()
+    return _ids[name]
+
+
+def clear():
+    """Look the IDs up again, or read them from a newer cache file, when used next."""
+    global _ids
+    _ids = None
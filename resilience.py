@@ -0,0 +1,109 @@
+"""Retries, rate limits and circuit breakers for the calls to Odoo, the FTP server and the image hosts."""
+import logging
+import random
+import threading
+import time
+
+from instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def retry(call, what, transient, attempts=4, base_delay=1.0, max_delay=30.0):
+    """Return call(), calling it again after errors for which transient(error) is true.
+
+    Only use it for calls that can safely be repeated. The delay before the nth retry
+    is random between 0 and base_delay * 2 ** (n - 1), at most max_delay, so that
+    clients failing at the same time do not retry at the same time either.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return call()
+        except Exception as e:
+            if attempt == attempts or not transient(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+            logger.warning("%s failed (%r), retrying in %.1fs", what, e, delay)
+            metrics.count("retries")
+            time.sleep(delay)
+
+
+class TokenBucket:
+    """Limits calls to rate per second on average, allowing bursts of up to burst calls.
+
+    Shared by all threads. A rate of None or 0 means no limit.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def acquire(self, tokens=1):
+        """Wait until tokens calls may be made."""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # Taking the tokens before waiting for them queues the callers in order
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            metrics.count("rate_limited")
+            time.sleep(wait)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Stops calls to an endpoint after failures failures in a row.
+
+    While the circuit is open, allow() returns false. After reset_after seconds
+    one call is allowed again: if it succeeds the circuit closes, if it fails it
+    stays open for another reset_after seconds.
+    """
+
+    def __init__(self, name, failures=5, reset_after=60):
+        self.name = name
+        self.failures = failures
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        self._failed = 0
+        self._opened = None
+
+    def allow(self):
+        with self._lock:
+            if self._opened is None:
+                return True
+            if time.monotonic() - self._opened >= self.reset_after:
+                # Let this call try, the others wait for its outcome
+                self._opened = time.monotonic()
+                return True
+            return False
+
+    def succeeded(self):
+        with self._lock:
+            self._failed = 0
+            self._opened = None
+
+    def failed(self):
+        with self._lock:
+            self._failed += 1
+            if self._failed >= self.failures:
+                if self._opened is None:
+                    logger.warning(
+                        "%s failed %d times in a row, pausing calls for %ds",
+                        self.name,
+                        self._failed,
+                        self.reset_after,
+                    )
+                    metrics.count("circuits_opened")
+                self._opened = time.monotonic()
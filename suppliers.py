@@ -0,0 +1,486 @@
+"""The wholesalers whose catalogs are used to update products.
+
+An adapter knows how to load a supplier's catalog and how its articles map to
+Odoo fields. Matching products, diffing, batching and fetching images are done
+for all of them by update_engine.UpdateEngine.
+"""
+import csv
+import functools
+import logging
+import os
+from decimal import Decimal
+from ftplib import FTP
+
+import bnn
+import catalog
+import catalog_cache
+import references
+from instrumentation import metrics
+
+__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+
+logger = logging.getLogger(__name__)
+
+# VAT rates, see references.REFERENCES for their taxes and accounts
+# TODO(Leon Handreke): Have a FULL/REDUCED enum here
+MWST_RATES = (7, 19)
+
+TERRA_PFAND_8_CT = {"998810", "998790", "998730", "998840"}
+TERRA_PFAND_15_CT = {
+    "998405",
+    "998040",
+    "998310",
+    "998320",
+    "998402",
+    "998340",
+    "998393",
+    "998060",
+    "998450",
+    "998352",
+    "998417",
+    "998352",
+    "998427",
+    "998366",
+    "998393",
+    "998370",
+    "998360",
+    "998420",
+    "998790",
+    "998405",
+    "999020",
+    "998398",
+    "999010",
+    "999020",
+    "900067",
+    "998408",
+}
+
+TERRA_FTP_HOST = os.environ.get("TERRA_FTP_HOST", "order.terra-natur.com")
+TERRA_FTP_PORT = int(os.environ.get("TERRA_FTP_PORT", "21"))
+# Seconds to wait for the server to answer or send data
+TERRA_FTP_TIMEOUT = float(os.environ.get("TERRA_FTP_TIMEOUT", "60"))
+TERRA_WEBSHOP_URL = os.environ.get("TERRA_WEBSHOP_URL", "https://www.terra-natur.com/")
+AGIDRA_WEBSHOP_URL = os.environ.get("AGIDRA_WEBSHOP_URL", "https://www.agidra.com/")
+
+
+def connect_terra_ftp():
+    ftp = FTP(timeout=TERRA_FTP_TIMEOUT)
+    ftp.connect(TERRA_FTP_HOST, TERRA_FTP_PORT)
+    ftp.login("", "")
+    return ftp
+
+
+def tax_fields(mwst):
+    """Return the taxes and accounts of a product with the given VAT rate."""
+    return {
+        "property_account_income_id": references.get("account_income_{}".format(mwst)),
+        "property_account_expense_id": references.get(
+            "account_expense_{}".format(mwst)
+        ),
+        "taxes_id": [references.get("tax_ust_{}".format(mwst))],
+        "supplier_taxes_id": [references.get("tax_vst_{}".format(mwst))],
+    }
+
+
+class SupplierAdapter:
+    """A wholesaler whose catalog is used to update products with matching barcodes.
+
+    Subclasses set the class attributes and implement the methods below. Catalog
+    records are looked up by barcode and their fields read with record["field"].
+    """
+
+    # Used for metrics and the name of the --changed snapshot
+    name = None
+    # res.partner of the supplier in Odoo, a property looking it up in references
+    partner_id = None
+    # Minimum quantity of the orderpoints created for products in stock
+    orderpoint_min_qty = None
+    # Fields that end up in odoo for existing products, changes to others are ignored by --changed
+    tracked_fields = []
+
+    def load_catalog(self):
+        """Return the catalog by barcode.
+
+        Returns the same object as the previous call if the catalog did not change.
+        """
+        raise NotImplementedError
+
+    def image_url(self, barcode, record):
+        raise NotImplementedError
+
+    def purchase_qty(self, record):
+        """Return the number of sale units in one purchase unit (VPE)."""
+        raise NotImplementedError
+
+    def product_fields(self, product, record):
+        """Return the product.template fields for the record.
+
+        product is the product as read from Odoo. uom_po_id and the image are filled
+        in by the engine.
+        """
+        raise NotImplementedError
+
+    def supplier_info_fields(self, record):
+        """Return product_code, product_name and price of the supplierinfo."""
+        raise NotImplementedError
+
+
+def _bnn_int(text):
+    return int(bnn.number(text))
+
+
+def _mwst(kennung):
+    return 7 if kennung == "1" else 19
+
+
+def read_from_terra_bnn(lines, source_name, scopes=(bnn.FULL,)):
+    """Parse a Terra BNN price list.
+
+    lines can be a text file object or any iterable of lines, e.g. catalog_cache.iter_ftp_lines
+    to parse the file while it is being downloaded. Lists with another Umfang than
+    in scopes are rejected. Articles delisted by a partial list are marked as
+    removed, so that the result can be chained after the full catalog with
+    catalog.ChainCatalog. Invalid numbers raise catalog.ConversionError with
+    their line.
+    """
+    products_by_ean = catalog.Catalog(
+        {
+            "artikel_nr": catalog.TextColumn(),
+            "ean_laden": catalog.TextColumn(),
+            "bezeichnung": catalog.TextColumn(),
+            "hersteller": catalog.SharedTextColumn(),
+            "bestelleinheit": catalog.SharedTextColumn(),
+            # Anzahl Ladeneinheit pro Bestelleinheit
+            "bestelleinheit_menge": catalog.IntColumn(convert=_bnn_int),
+            # Der Mengenfaktor ist üblicherweise 1, was bedeutet, dass sich die Preise genau auf die Ladeneinheit
+            # z.B. bei Gewichtsartikeln statt kg-Preisen 100g-Preise angegeben, obwohl die Ladeneinheit kg ist, ist der
+            # Mengenfaktor 0,1: alle Preise beziehen sich also auf ein Zehntel der Ladeneinheit.
+            # Ist er leer, beziehen sich die Preise auf die Ladeneinheit.
+            "mengenfaktor": catalog.DecimalColumn(3, optional=True, default=Decimal(1)),
+            "mwst": catalog.IntColumn(convert=_mwst),
+            # Preis pro Ladeneinheit
+            "preis": catalog.DecimalColumn(2),
+            "pfand_nr_ladeneinheit": catalog.SharedTextColumn(),
+            "pfand_nr_bestelleinheit": catalog.SharedTextColumn(),
+            "grundpreis_einheit": catalog.SharedTextColumn(),
+            # None if empty
+            "grundpreis_faktor": catalog.DecimalColumn(3, optional=True),
+            "source_name": catalog.SharedTextColumn(),
+        }
+    )
+
+    reader = bnn.BnnReader(
+        lines,
+        [
+            "aenderungskennung",
+            "artikel_nr",
+            "ean_laden",
+            "bezeichnung",
+            "bezeichnung2",
+            "bezeichnung3",
+            "hersteller",
+            "bestelleinheit",
+            "bestelleinheit_menge",
+            "mengenfaktor",
+            "mwst_kennung",
+            "preis",
+            "pfand_nr_ladeneinheit",
+            "pfand_nr_bestelleinheit",
+            "grundpreis_einheit",
+            "grundpreis_faktor",
+        ],
+        scopes=scopes,
+    )
+    # Rows are tuples of the fields above, the ones after bezeichnung3 are in the
+    # order of the catalog columns
+    add = products_by_ean.add
+    source = (source_name,)
+    for row in reader:
+        ean_laden = row[2]
+        if row[0] == bnn.DELISTED:
+            # Only partial lists return them, they hide the article of the full list
+            products_by_ean.remove(ean_laden)
+            continue
+
+        # Index by EANladen, values in the order of the columns above
+        add(
+            ean_laden,
+            (row[1], ean_laden, row[3] + row[4] + row[5]) + row[6:] + source,
+            reader.line_num,
+        )
+    products_by_ean.finish()
+    return products_by_ean
+
+
+def read_from_agidra_csv(infile):
+    products_by_ean = catalog.Catalog(
+        {
+            "name": catalog.TextColumn(),
+            "price_sale_unit": catalog.DecimalColumn(2, separator="."),
+            "vpe": catalog.IntColumn(),
+            "price_vpe": catalog.DecimalColumn(2, separator="."),
+            "weight_sale_unit": catalog.DecimalColumn(2, separator="."),
+            "uom": catalog.SharedTextColumn(),
+            "tva": catalog.DecimalColumn(1, separator="."),
+            "supplier_code": catalog.TextColumn(),
+        }
+    )
+    reader = csv.DictReader(infile)
+    for row in reader:
+        products_by_ean.add(
+            row["Code EAN"],
+            (
+                row["Désignation produit"],
+                row["Prix/U."],
+                int(Decimal(row["Colisage"])),
+                row["P. Conditionement"],
+                row["Poids brut"],
+                # Sometimes the OUM colum is empty
+                row["Unité de poids"] or "KG",
+                row["TVA"],
+                row["REF"],
+            ),
+            reader.line_num,
+        )
+    products_by_ean.finish()
+    return products_by_ean
+
+
+TERRA_TRACKED_FIELDS = [
+    "artikel_nr",
+    "bezeichnung",
+    "bestelleinheit_menge",
+    "mengenfaktor",
+    "mwst",
+    "preis",
+    "pfand_nr_ladeneinheit",
+    "pfand_nr_bestelleinheit",
+    "grundpreis_einheit",
+    "grundpreis_faktor",
+]
+AGIDRA_TRACKED_FIELDS = [
+    "name",
+    "vpe",
+    "price_vpe",
+    "weight_sale_unit",
+    "uom",
+    "tva",
+    "supplier_code",
+]
+
+
+class TerraAdapter(SupplierAdapter):
+    name = "terra"
+    orderpoint_min_qty = 2.0
+    tracked_fields = TERRA_TRACKED_FIELDS
+
+    FILES = [
+        ("PL_FOOD.bnn", "food"),
+        ("PL_DROG.bnn", "drog"),
+        ("PL_FRISCH.bnn", "frisch"),
+    ]
+
+    def __init__(self):
+        with open(os.path.join(__location__, "producers.csv"), mode="r") as infile:
+            reader = csv.reader(infile)
+            self.producers = {l[0]: l[1] for l in reader}
+        self._parts = None
+        self._catalog = None
+
+    @property
+    def partner_id(self):
+        return references.get("partner_terra")
+
+    def load_catalog(self):
+        # Downloading and parsing overlap, so they are timed together
+        with metrics.phase("load_terra"):
+            parts = catalog_cache.load_ftp_catalogs(
+                connect_terra_ftp,
+                [
+                    (
+                        filename,
+                        functools.partial(read_from_terra_bnn, source_name=source_name),
+                    )
+                    for filename, source_name in self.FILES
+                ],
+            )
+        # Unchanged files are returned as the same objects
+        if self._parts is None or any(a is not b for a, b in zip(parts, self._parts)):
+            self._parts = parts
+            self._catalog = catalog.ChainCatalog(parts)
+        return self._catalog
+
+    def image_url(self, barcode, record):
+        return "{}_artikelbilder_/{}/{}_medium.jpg".format(
+            TERRA_WEBSHOP_URL, barcode, barcode
+        )
+
+    def purchase_qty(self, record):
+        return record["bestelleinheit_menge"]
+
+    def product_fields(self, product, t):
+        ek = t["preis"] / t["mengenfaktor"]
+        pfand = t["pfand_nr_ladeneinheit"] or t["pfand_nr_bestelleinheit"]
+
+        product_name = t["bezeichnung"]
+        # Some products in Terra have a weird "> " prefix
+        product_name = product_name.removeprefix("> ")
+
+        producer = self.producers.get(t["hersteller"], t["hersteller"])
+        product_name += " (%s)" % producer
+
+        mwst = t["mwst"]
+        product_fields = tax_fields(mwst)
+
+        if pfand:
+            product_name += " (inkl. Pfand)"
+            if pfand in TERRA_PFAND_8_CT:
+                product_fields["taxes_id"].append(references.get("tax_pfand_8_ct"))
+            elif pfand in TERRA_PFAND_15_CT:
+                product_fields["taxes_id"].append(references.get("tax_pfand_15_ct"))
+            else:
+                product_fields["taxes_id"].append(references.get("tax_pfand_15_ct"))
+                # Make it debug for now so that I don't get too many emails
+                logger.debug(
+                    "Cost for Pfandeinheit %s for product %s not found.",
+                    pfand,
+                    t["ean_laden"],
+                )
+
+        product_fields.update(
+            {
+                # Pfand to Cost (to calc sales price) but not to supplier price
+                "standard_price": round(ek, 2),
+                "type": "product",
+            }
+        )
+
+        if product["name"] == "NEW":
+            product_fields.update(
+                {
+                    "name": product_name,
+                    "available_in_pos": True,
+                    "print_category_id": 1,  # Print Supermarket Pricetags
+                    "margin_classification_id": 2
+                    if t["source_name"] == "frisch"
+                    else 1,  # 26% or General (23% Handelsspanne)
+                }
+            )
+
+        if t["grundpreis_einheit"] and t["grundpreis_faktor"] is not None:
+            unit = t["grundpreis_einheit"].lower()
+            if unit == "lt":
+                unit = "l"
+            product_fields["base_price_unit"] = unit
+            product_fields["base_price_factor"] = round(t["grundpreis_faktor"], 3)
+
+        product_fields["public_categ_ids"] = []
+        # if t["e-Product Category "]:
+        #     public_category = c.get('product.public.category', [('name', '=', t["e-Product Category "])])
+        #     if public_category:
+        #         # (4, id, ) ADD
+        #         product_fields["public_categ_ids"].append((4, public_category["id"], 0))
+        #     else:
+        #         logger.warning("Category \"%s\" not found", t["e-Product Category "])
+
+        # if t["Gluten"] in ["N", "S"]:
+        #     product_fields["public_categ_ids"].append(
+        #         (4, references.get("category_glutenfrei"), 0)
+        #     )
+        return product_fields
+
+    def supplier_info_fields(self, t):
+        return {
+            "product_code": t["artikel_nr"],
+            "product_name": t["bezeichnung"],
+            "price": t["preis"] / t["mengenfaktor"] * t["bestelleinheit_menge"],
+        }
+
+
+class AgidraAdapter(SupplierAdapter):
+    name = "agidra"
+    orderpoint_min_qty = 8.0
+    tracked_fields = AGIDRA_TRACKED_FIELDS
+
+    FILES = [
+        os.path.join(__location__, "data/agidra.csv"),
+        os.path.join(__location__, "data/agidra-2021-10-27.csv"),
+    ]
+
+    def __init__(self):
+        self._mtimes = None
+        self._catalog = None
+
+    @property
+    def partner_id(self):
+        return references.get("partner_agidra")
+
+    def load_catalog(self):
+        # The files are only read again if they were modified
+        mtimes = [os.stat(filename).st_mtime for filename in self.FILES]
+        if mtimes != self._mtimes:
+            with metrics.phase("load_agidra"):
+                parts = []
+                for filename in self.FILES:
+                    with open(filename, mode="r") as infile:
+                        parts.append(read_from_agidra_csv(infile))
+            self._mtimes = mtimes
+            self._catalog = catalog.ChainCatalog(parts)
+        return self._catalog
+
+    def image_url(self, barcode, agidra_product):
+        return "{}images/vignettes/{}_Z1.jpg".format(
+            AGIDRA_WEBSHOP_URL, agidra_product["supplier_code"]
+        )
+
+    def purchase_qty(self, agidra_product):
+        return agidra_product["vpe"]
+
+    def product_fields(self, product, agidra_product):
+        ek = agidra_product["price_vpe"] / agidra_product["vpe"]
+
+        delivery_cost = Decimal("0")
+        if agidra_product["uom"] in ["LIT", "KG"]:
+            delivery_cost = Decimal("0.25") * agidra_product["weight_sale_unit"]
+        else:
+            logger.warning("Unknown uom for Agdira product: %s", agidra_product["uom"])
+
+        mwst = 7 if agidra_product["tva"] == Decimal("5.5") else 19
+        product_fields = tax_fields(mwst)
+        product_fields.update(
+            {
+                "standard_price": round(ek + delivery_cost, 2),
+                "type": "product",
+            }
+        )
+
+        if product["name"] == "NEW":
+            product_fields.update(
+                {
+                    "name": agidra_product["name"],
+                    "available_in_pos": True,
+                    "print_category_id": 1,  # Print Supermarket Pricetags
+                    "margin_classification_id": 1,  # General (23% Handelsspanne)
+                }
+            )
+
+        if agidra_product["uom"]:
+            unit = agidra_product["uom"].lower()
+            if unit == "lit":
+                unit = "l"
+            product_fields["base_price_unit"] = unit
+            product_fields["base_price_factor"] = round(
+                Decimal("1.0") / agidra_product["weight_sale_unit"], 3
+            )
+        return product_fields
+
+    def supplier_info_fields(self, agidra_product):
+        return {
+            "product_code": agidra_product["supplier_code"],
+            "product_name": agidra_product["name"],
+            "price": agidra_product["price_vpe"],
+        }
+
+
+# In the order in which products are matched against the catalogs
+ADAPTERS = [TerraAdapter, AgidraAdapter]
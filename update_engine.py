@@ -0,0 +1,751 @@
+"""Updates Odoo products from the catalogs of all supplier adapters.
+
+The engine matches products to catalog articles by barcode, computes which fields
+changed, batches the writes and fetches images, the same way for every supplier.
+"""
+import collections
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+import catalog_cache
+import catalog_diff
+import changeset
+import image_cache
+import odoo_snapshot
+import odoo_utils
+import references
+from instrumentation import metrics
+from suppliers import MWST_RATES
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_FIELDS = [
+    "id",
+    "name",
+    "barcode",
+    "qty_available",
+    "product_variant_id",
+    "taxes_id",
+    "uom_id",
+    "supplier_taxes_id",
+    "standard_price",
+    "property_account_income_id",
+    "property_account_expense_id",
+    "margin_classification_id",
+    "print_category_id",
+    "base_price_unit",
+    "base_price_factor",
+    "available_in_pos",
+    "type",
+    "uom_po_id",
+]
+
+SUPPLIER_INFO_FIELDS = [
+    "name",
+    "product_name",
+    "product_code",
+    "product_tmpl_id",
+    "price",
+]
+
+ORDERPOINT_FIELDS = ["product_min_qty", "product_max_qty", "product_id"]
+
+# Fields kept in the local snapshot of Odoo. qty_available is computed from stock
+# moves without changing write_date, it is always read from Odoo.
+SNAPSHOT_MODELS = {
+    "product.template": [
+        field for field in PRODUCT_FIELDS if field not in ("id", "qty_available")
+    ]
+    + ["image"],
+    "product.supplierinfo": SUPPLIER_INFO_FIELDS,
+    "stock.warehouse.orderpoint": ORDERPOINT_FIELDS,
+}
+
+
+def compute_product_field_updates(old, updated):
+    # Special handling to deal with the broken fact that odoo saves prices as floats
+    if "standard_price" in old:
+        old["standard_price"] = round(Decimal(str(old["standard_price"])), 2)
+    if "base_price_factor" in old:
+        old["base_price_factor"] = round(Decimal(str(old["base_price_factor"])), 3)
+
+    field_updates = dict()
+    for field_name in [
+        "name",
+        "available_in_pos",
+        "standard_price",
+        "type",
+        "base_price_unit",
+        "base_price_factor",
+    ]:
+        if (field_name not in old) or (
+            field_name in updated and old[field_name] != updated[field_name]
+        ):
+            field_updates[field_name] = updated[field_name]
+
+    # Images are not read from odoo, only whether there is one (has_image)
+    if "image" in updated and not old.get("has_image", False):
+        field_updates["image"] = updated["image"]
+
+    # References, they are in the format [id, name] from odoo but only id in updated
+    for field_name in [
+        "print_category_id",
+        "margin_classification_id",
+        "uom_po_id",
+        "property_account_income_id",
+        "property_account_expense_id",
+    ]:
+        if (field_name not in old) or (
+            field_name in updated and (old[field_name] == False or old[field_name][0] != updated[field_name])
+        ):
+            field_updates[field_name] = updated[field_name]
+
+    # Many fields, use ORM update syntax
+    for field_name in ["taxes_id", "supplier_taxes_id"]:
+        if (field_name not in old) or (
+            field_name in updated and set(old[field_name]) != set(updated[field_name])
+        ):
+            field_updates[field_name] = [(6, 0, updated[field_name])]
+
+    if "standard_price" in field_updates:
+        field_updates["standard_price"] = str(field_updates["standard_price"])
+    if "base_price_factor" in field_updates:
+        field_updates["base_price_factor"] = str(field_updates["base_price_factor"])
+
+    return field_updates
+
+
+def compute_supplier_info_field_updates(old, updated):
+    # Special handling to deal with the broken fact that odoo saves prices as floats
+    if "price" in old:
+        old["price"] = round(Decimal(str(old["price"])), 2)
+
+    field_updates = dict()
+    for field_name in ["product_code", "product_name", "price"]:
+        if (field_name not in old) or (
+            field_name in updated and old[field_name] != updated[field_name]
+        ):
+            field_updates[field_name] = updated[field_name]
+
+    # References, they are in the format [id, name] from odoo but only id in updated
+    for field_name in ["name", "product_tmpl_id"]:
+        if (field_name not in old) or (
+            field_name in updated and old[field_name][0] != updated[field_name]
+        ):
+            field_updates[field_name] = updated[field_name]
+
+    if "price" in field_updates:
+        field_updates["price"] = str(field_updates["price"])
+
+    return field_updates
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def match(adapters, catalogs, barcode):
+    """Return the first adapter whose catalog contains barcode and its record, or (None, None)."""
+    for adapter in adapters:
+        record = catalogs[adapter.name].get(barcode)
+        if record is not None:
+            return adapter, record
+    return None, None
+
+
+class _Recorder:
+    """The writes, creates and log messages for one product, in the order they were made."""
+
+    __slots__ = ("calls",)
+
+    def __init__(self):
+        self.calls = []
+
+    def write(self, entity, ids, fields):
+        self.calls.append(("write", (entity, ids, fields)))
+
+    def create(self, entity, fields):
+        self.calls.append(("create", (entity, fields)))
+
+    def log(self, level, msg, *args):
+        self.calls.append(("log", (level, msg) + args))
+
+
+class ProductUpdater:
+    """Computes how products have to change from the catalogs and the Odoo records read before.
+
+    Makes no calls to Odoo, so it can run in other processes: the units of measure
+    in uoms must already contain every unit the products need and images the
+    downloaded images of the products without one.
+    """
+
+    def __init__(self, adapters, catalogs, supplier_infos, orderpoints):
+        self.adapters = adapters
+        self.catalogs = catalogs
+        self.supplier_infos = supplier_infos
+        self.orderpoints = orderpoints
+        self.uoms = None
+        self.images = {}
+
+    def match(self, barcode):
+        return match(self.adapters, self.catalogs, barcode)
+
+    def get_supplier_info_for_product(self, product_id, supplier_id=None):
+        """Return the supplierinfo of the product, preferring the one of supplier_id if given."""
+        return self.supplier_infos.get(
+            product_id,
+            predicate=supplier_id
+            and (lambda si: si["name"] and si["name"][0] == supplier_id),
+        )
+
+    def get_orderpoint_for_product(self, product_id):
+        return self.orderpoints.get(product_id)
+
+    def compute(self, p, adapter, record):
+        """Return the calls updating product p as (method, args), logging is method "log"."""
+        out = _Recorder()
+        if adapter:
+            self.update_from_supplier(out, adapter, p, record)
+        else:
+            self.update_other_product(out, p)
+        return out.calls
+
+    def update_from_supplier(self, out, adapter, p, record):
+        barcode = p["barcode"]
+        vpe = adapter.purchase_qty(record)
+
+        product_fields = adapter.product_fields(p, record)
+        # Match category of sale unit in Purchase OUM. This is to allow to switch to kg
+        uom = self.uoms.get(p["uom_id"][0])
+        uom_po_id = self.uoms.find_purchase_uom(vpe, uom["category_id"][0])
+        if uom_po_id is None:
+            # UpdateEngine._create_purchase_uoms creates them before
+            raise LookupError(
+                "No purchase unit of {} {} for product {} ({})".format(
+                    vpe, uom["name"], p["id"], barcode
+                )
+            )
+        product_fields["uom_po_id"] = uom_po_id
+        image_url = adapter.image_url(barcode, record)
+        if not p["has_image"] and self.images.get(image_url):
+            product_fields["image"] = self.images[image_url]
+
+        field_updates = compute_product_field_updates(p, product_fields)
+        if field_updates:
+            out.log(
+                logging.INFO,
+                'Updating product %d "%s": %s',
+                p["id"],
+                p["name"],
+                field_updates,
+            )
+            out.write("product.template", [p["id"]], field_updates)
+        else:
+            out.log(logging.DEBUG, 'No update required for product "%s"', p["name"])
+
+        supplier_info_fields = {
+            "name": adapter.partner_id,
+            "product_tmpl_id": p["id"],
+            **adapter.supplier_info_fields(record),
+        }
+        supplier_info = self.get_supplier_info_for_product(p["id"], adapter.partner_id)
+        field_updates = compute_supplier_info_field_updates(
+            supplier_info or {}, supplier_info_fields
+        )
+        if supplier_info:
+            if field_updates:
+                out.log(
+                    logging.INFO,
+                    'Updating supplierinfo %d for product "%s" %s',
+                    supplier_info["id"],
+                    p["name"],
+                    field_updates,
+                )
+                out.write("product.supplierinfo", [supplier_info["id"]], field_updates)
+            else:
+                out.log(
+                    logging.DEBUG,
+                    'No supplierinfo update required for product "%s"',
+                    p["name"],
+                )
+        else:
+            out.log(logging.INFO, 'Creating supplierinfo for product "%s"', p["name"])
+            out.create("product.supplierinfo", field_updates)
+
+        product_variant_id = p["product_variant_id"][0]
+        reordering_rule = self.get_orderpoint_for_product(product_variant_id)
+        if p["qty_available"] > 0 and not reordering_rule:
+            out.log(
+                logging.INFO,
+                'Creating orderpoint for product %d "%s"',
+                p["id"],
+                p["name"],
+            )
+            out.create(
+                "stock.warehouse.orderpoint",
+                {
+                    "product_min_qty": adapter.orderpoint_min_qty,
+                    "product_max_qty": vpe,
+                    "product_id": product_variant_id,
+                },
+            )
+
+    def update_other_product(self, out, p):
+        supplier_info = self.get_supplier_info_for_product(p["id"])
+
+        # If only cost is filled and supplier_info price is 0, transfer it as a convenience
+        if supplier_info and p["standard_price"] != 0 and supplier_info["price"] == 0:
+
+            uom = self.uoms.get(p["uom_po_id"][0])
+            supplier_info_fields = {"price": p["standard_price"] * uom["factor_inv"]}
+
+            out.log(
+                logging.INFO,
+                'Updating supplierinfo %d for product "%s" %s',
+                supplier_info["id"],
+                p["name"],
+                supplier_info_fields,
+            )
+            out.write(
+                "product.supplierinfo", [supplier_info["id"]], supplier_info_fields
+            )
+
+        # Make sure Product Category follows tax setting
+        mwst = next(
+            (
+                rate
+                for rate in MWST_RATES
+                if references.get("tax_ust_{}".format(rate)) in p["taxes_id"]
+            ),
+            None,
+        )
+
+        if mwst:
+            income_account_id = references.get("account_income_{}".format(mwst))
+            expense_account_id = references.get("account_expense_{}".format(mwst))
+            income_account_correct = (
+                p["property_account_income_id"]
+                and p["property_account_income_id"][0] == income_account_id
+            )
+            expense_account_correct = (
+                p["property_account_expense_id"]
+                and p["property_account_expense_id"][0] == expense_account_id
+            )
+            if not (income_account_correct and expense_account_correct):
+                product_fields = {
+                    "property_account_income_id": income_account_id,
+                    "property_account_expense_id": expense_account_id,
+                }
+                out.log(
+                    logging.INFO, 'Updating product "%s": %s', p["name"], product_fields
+                )
+                out.write("product.template", [p["id"]], product_fields)
+
+
+# The ProductUpdater of a worker process, see UpdateEngine._computed_in_processes
+_worker_updater = None
+
+
+def _init_worker(updater):
+    global _worker_updater
+    _worker_updater = updater
+
+
+def _compute_chunk(products, uoms, images):
+    updater = _worker_updater
+    updater.uoms = uoms
+    updater.images = images
+    results = []
+    for p in products:
+        adapter, record = updater.match(p["barcode"])
+        results.append(
+            (adapter.name if adapter else "other", updater.compute(p, adapter, record))
+        )
+    return results
+
+
+class UpdateEngine:
+    """Updates products from the catalogs of adapters, see suppliers.SupplierAdapter.
+
+    A product is updated from the first adapter whose catalog contains its barcode.
+    Products no catalog contains get some housekeeping only.
+    """
+
+    def __init__(
+        self,
+        c,
+        adapters,
+        batch_size=500,
+        concurrency=1,
+        checkpoint_every=1000,
+        changeset=None,
+        use_snapshot=False,
+        processes=1,
+    ):
+        self.c = c
+        self.adapters = adapters
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.checkpoint_every = checkpoint_every
+        # Products are computed in this many processes, see ProductUpdater
+        self.processes = processes
+        self.image_fetcher = image_cache.ImageFetcher()
+        self.catalogs = {}
+        self.diffs = {}
+        # Changes are recorded in the changeset instead of written if given
+        self.changeset = changeset
+        self.uoms = odoo_utils.UomRegistry(c, changeset)
+        # Full updates read products, supplierinfos and orderpoints from here if set
+        self.snapshot = None
+        if use_snapshot:
+            self.snapshot = odoo_snapshot.OdooSnapshot(c, SNAPSHOT_MODELS)
+
+        # Odoo state of the current update, set by update_products
+        self.writer = None
+        self.images = {}
+        self.supplier_infos = None
+        self.orderpoints = None
+
+    # Catalogs
+
+    def load_catalogs(self, keep_last=False):
+        """Load the catalogs of all adapters, return whether any changed since the last call.
+
+        With keep_last, errors are logged instead of raised and an adapter whose
+        catalog cannot be loaded keeps the one loaded before, if any, see has_catalogs.
+        """
+        changed = False
+        for adapter in self.adapters:
+            try:
+                loaded = adapter.load_catalog()
+            except Exception:
+                if not keep_last:
+                    raise
+                logger.exception(
+                    "Loading the %s catalog failed, %s",
+                    adapter.name,
+                    "using the one loaded before"
+                    if adapter.name in self.catalogs
+                    else "there is none yet",
+                )
+                continue
+            if loaded is not self.catalogs.get(adapter.name):
+                self.catalogs[adapter.name] = loaded
+                self.diffs[adapter.name] = catalog_diff.CatalogDiff(
+                    adapter.name, loaded, adapter.tracked_fields
+                )
+                changed = True
+        return changed
+
+    def has_catalogs(self):
+        """Return whether the catalogs of all adapters were loaded."""
+        return all(adapter.name in self.catalogs for adapter in self.adapters)
+
+    def changed_barcodes(self):
+        """Return the barcodes whose catalog data changed since save_applied()."""
+        changed = set()
+        for diff in self.diffs.values():
+            changed |= diff.changed_keys()
+        return sorted(changed)
+
+    def save_applied(self):
+        """Remember the current catalogs as applied to Odoo."""
+        for diff in self.diffs.values():
+            diff.save()
+
+    def match(self, barcode):
+        """Return the adapter and catalog record for a barcode, or (None, None)."""
+        return match(self.adapters, self.catalogs, barcode)
+
+    def clear_caches(self):
+        self.uoms.clear()
+        references.clear()
+        catalog_cache.forget_loaded()
+
+    # Odoo state
+
+    def _fetch_images(self, products_without_image):
+        image_urls = []
+        for p in products_without_image:
+            adapter, record = self.match(p["barcode"])
+            if adapter:
+                image_urls.append(adapter.image_url(p["barcode"], record))
+        self.images = self.image_fetcher.fetch_all(image_urls)
+        metrics.count("images_fetched", sum(1 for img in self.images.values() if img))
+
+    def _new_writer(self):
+        return odoo_utils.BatchWriter(
+            self.c,
+            batch_size=self.batch_size,
+            concurrency=self.concurrency,
+            on_sent=self._written if self.snapshot else None,
+        )
+
+    def _written(self, method, entity, ids, values):
+        if method == "create":
+            self.snapshot.created(entity, ids, values)
+        else:
+            self.snapshot.written(entity, ids, values)
+
+    def _read_from_snapshot(self, search_cond):
+        """Return the products matching search_cond and set supplier_infos and orderpoints."""
+        c = self.c
+        product_ids = c.search("product.template", search_cond)
+        self.snapshot.sync()
+        products = self.snapshot.records("product.template", product_ids)
+        self.supplier_infos = odoo_utils.RecordIndex(
+            self.snapshot.records("product.supplierinfo"), "product_tmpl_id"
+        )
+        self.orderpoints = odoo_utils.RecordIndex(
+            self.snapshot.records("stock.warehouse.orderpoint"), "product_id"
+        )
+
+        # Stock is only looked at for products without orderpoint
+        without_orderpoint = [
+            p["id"]
+            for p in products
+            if not self.orderpoints.get(p["product_variant_id"][0])
+        ]
+        qty_available = {}
+        if without_orderpoint:
+            qty_available = {
+                p["id"]: p["qty_available"]
+                for p in c.search_read_iter(
+                    "product.template",
+                    [["id", "in", without_orderpoint]],
+                    fields=["qty_available"],
+                )
+            }
+        for p in products:
+            p["qty_available"] = qty_available.get(p["id"], 0)
+        return products
+
+    def update_products(
+        self, search_cond, supplier_info_cond=(), orderpoint_cond=(), checkpoint=None
+    ):
+        """Update the products matching search_cond from the loaded catalogs.
+
+        supplier_info_cond and orderpoint_cond restrict reading supplierinfos and
+        orderpoints to the products we look at where that is cheap. Without them,
+        everything is read from the snapshot if the engine has one. If checkpoint is
+        the name of a state file, products up to the last ID recorded in it are skipped
+        and progress is recorded there every checkpoint_every products.
+        Returns whether products were skipped because of the checkpoint.
+        """
+        c = self.c
+        if self.changeset is not None:
+            # A changeset is only saved once it is complete
+            checkpoint = None
+        resumed_after = None
+        if checkpoint:
+            resumed_after = catalog_cache.read_state(checkpoint, {}).get(
+                "last_product_id"
+            )
+        if resumed_after:
+            logger.info("Resuming after product %d", resumed_after)
+            search_cond = search_cond + [["id", ">", resumed_after]]
+
+        if self.changeset is not None:
+            self.writer = self.changeset
+        else:
+            self.writer = self._new_writer()
+
+        if self.snapshot and not supplier_info_cond and not orderpoint_cond:
+            with metrics.phase("load_odoo"):
+                products = self._read_from_snapshot(search_cond)
+            products_without_image = [p for p in products if not p["has_image"]]
+        else:
+            products = c.search_read_iter(
+                "product.template", search_cond, fields=PRODUCT_FIELDS
+            )
+
+            # Only find out whether a product has an image, reading the images themselves is expensive
+            with metrics.phase("load_odoo"):
+                products_without_image = c.search_read(
+                    "product.template",
+                    search_cond + [["image", "=", False]],
+                    fields=["barcode"],
+                )
+                self.supplier_infos = odoo_utils.RecordIndex(
+                    c.search_read_iter(
+                        "product.supplierinfo",
+                        list(supplier_info_cond),
+                        fields=SUPPLIER_INFO_FIELDS,
+                    ),
+                    "product_tmpl_id",
+                )
+                self.orderpoints = odoo_utils.RecordIndex(
+                    c.search_read_iter(
+                        "stock.warehouse.orderpoint",
+                        list(orderpoint_cond),
+                        fields=ORDERPOINT_FIELDS,
+                    ),
+                    "product_id",
+                )
+        product_ids_without_image = {p["id"] for p in products_without_image}
+
+        # Download all images that we are going to need up front and in parallel
+        with metrics.phase("fetch_images"):
+            self._fetch_images(products_without_image)
+
+        # ProductUpdater must not call Odoo, also not in other processes
+        with metrics.phase("load_odoo"):
+            references.load(lambda: c)
+        updater = ProductUpdater(
+            self.adapters, self.catalogs, self.supplier_infos, self.orderpoints
+        )
+        if self.processes > 1:
+            computed = self._computed_in_processes(
+                updater, products, product_ids_without_image
+            )
+        else:
+            computed = self._computed(updater, products, product_ids_without_image)
+
+        n = 0
+        for product_id, source, calls in computed:
+            n += 1
+            with metrics.phase("update_" + source):
+                for method, args in calls:
+                    if method == "log":
+                        logger.log(*args)
+                    else:
+                        getattr(self.writer, method)(*args)
+            metrics.count("products_" + source)
+
+            # Products are read in ID order, everything up to here is done once it is sent
+            if checkpoint and n % self.checkpoint_every == 0:
+                with metrics.phase("flush_writes"):
+                    self.writer.flush()
+                catalog_cache.write_state(checkpoint, {"last_product_id": product_id})
+        with metrics.phase("flush_writes"):
+            self.writer.flush()
+        if checkpoint:
+            catalog_cache.remove_state(checkpoint)
+
+        if self.changeset is None:
+            with metrics.phase("translation_cleanup"):
+                self.delete_product_name_translations()
+        return bool(resumed_after)
+
+    def apply_changeset(self, path):
+        """Send the changes saved by a run with a changeset to Odoo."""
+        self.writer = self._new_writer()
+        with metrics.phase("flush_writes"):
+            changeset.apply(path, self.c, self.writer)
+        with metrics.phase("translation_cleanup"):
+            self.delete_product_name_translations()
+
+    def _prepared_chunks(self, products, product_ids_without_image):
+        """Yield chunks of products with everything ProductUpdater needs from Odoo in place."""
+        chunks = _chunks(products, self.c.read_page_size)
+        while True:
+            # products can be an iterator still reading the products from Odoo
+            with metrics.phase("load_odoo"):
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                self._create_purchase_uoms(chunk)
+            for p in chunk:
+                p["has_image"] = p["id"] not in product_ids_without_image
+            yield chunk
+
+    def _computed(self, updater, products, product_ids_without_image):
+        """Yield (product ID, source, calls) for every product, see ProductUpdater.compute."""
+        updater.uoms = self.uoms
+        updater.images = self.images
+        for chunk in self._prepared_chunks(products, product_ids_without_image):
+            for p in chunk:
+                adapter, record = updater.match(p["barcode"])
+                source = adapter.name if adapter else "other"
+                with metrics.phase("update_" + source):
+                    calls = updater.compute(p, adapter, record)
+                yield p["id"], source, calls
+
+    def _computed_in_processes(self, updater, products, product_ids_without_image):
+        """Like _computed, but computes chunks of products in a pool of processes.
+
+        The catalogs and Odoo records every product may need are handed to the
+        workers once when they start. The units of measure and the images of a chunk
+        are sent along with it. Results are yielded in the order of the products.
+        """
+        with ProcessPoolExecutor(
+            self.processes, initializer=_init_worker, initargs=(updater,)
+        ) as executor:
+            # Start the workers before products are read, reading runs threads
+            executor.submit(int).result()
+
+            pending = collections.deque()
+            for chunk in self._prepared_chunks(products, product_ids_without_image):
+                images = {}
+                for p in chunk:
+                    adapter, record = updater.match(p["barcode"])
+                    if adapter and not p["has_image"]:
+                        url = adapter.image_url(p["barcode"], record)
+                        images[url] = self.images.get(url)
+                future = executor.submit(_compute_chunk, chunk, self.uoms, images)
+                pending.append((chunk, future))
+                # Keep the workers busy without reading ahead too far
+                if len(pending) > 2 * self.processes:
+                    yield from self._chunk_results(*pending.popleft())
+            while pending:
+                yield from self._chunk_results(*pending.popleft())
+
+    @staticmethod
+    def _chunk_results(chunk, future):
+        with metrics.phase("compute"):
+            results = future.result()
+        for p, (source, calls) in zip(chunk, results):
+            yield p["id"], source, calls
+
+    def _create_purchase_uoms(self, products):
+        """Create the purchase units that the products will need in one call.
+
+        Also makes sure that the units of all products are loaded.
+        """
+        units = set()
+        for p in products:
+            uom = self.uoms.get(p["uom_id"][0])
+            self.uoms.get(p["uom_po_id"][0])
+            adapter, record = self.match(p["barcode"])
+            if adapter:
+                units.add((adapter.purchase_qty(record), uom["category_id"][0]))
+        self.uoms.create_purchase_uoms(units)
+
+    def delete_product_name_translations(self):
+        """Delete the translations of product names so that the name is the same in every language.
+
+        All of them were deleted by the previous run, so only translations newer than that
+        and ones of products written in this run have to be looked at.
+        """
+        state = catalog_cache.read_state("translations.json", {})
+        cond = [["name", "=", "product.template,name"]]
+        last_deleted_id = state.get("last_deleted_id")
+        written_product_ids = sorted(self.writer.written_ids["product.template"])
+        if last_deleted_id and written_product_ids:
+            cond += [
+                "|",
+                ["id", ">", last_deleted_id],
+                ["res_id", "in", written_product_ids],
+            ]
+        elif last_deleted_id:
+            cond.append(["id", ">", last_deleted_id])
+
+        translations_to_delete = self.c.search("ir.translation", cond)
+        if not translations_to_delete:
+            return
+        logger.debug(
+            "Deleting %d product name translations", len(translations_to_delete)
+        )
+        self.c.unlink("ir.translation", translations_to_delete)
+        catalog_cache.write_state(
+            "translations.json",
+            {"last_deleted_id": max(translations_to_delete + [last_deleted_id or 0])},
+        )